@@ -0,0 +1,101 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize_question(question):
+    """Lower-case, collapse whitespace and drop trailing punctuation for exact matching"""
+    return re.sub(r"\s+", " ", question).strip().lower().rstrip("?!. ")
+
+
+class AnswerCache:
+    """Process-wide cache of answers, keyed on an index fingerprint plus the question.
+
+    Lookups try an exact match on the normalized question first, then the most similar
+    cached question for the same index whose embedding cosine similarity clears the
+    threshold. Entries expire after ttl_seconds and the least recently used are evicted
+    beyond max_entries.
+    """
+
+    def __init__(self, max_entries=512, ttl_seconds=3600, similarity_threshold=0.92):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _unit(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _expired(self, entry, now):
+        return self.ttl_seconds > 0 and now - entry["created"] > self.ttl_seconds
+
+    def get(self, fingerprint, question, embed_query=None):
+        """Return (answer, query_vector) on a hit, or (None, query_vector) on a miss.
+
+        embed_query is only called when there is no exact match; its result is handed
+        back so the caller can pass it to put() without embedding the question twice.
+        """
+        key = (fingerprint, normalize_question(question))
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry, now):
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return entry["answer"], None
+
+        if embed_query is None:
+            with self._lock:
+                self.misses += 1
+            return None, None
+
+        query_vector = self._unit(embed_query(question))
+        with self._lock:
+            best_key, best_score = None, self.similarity_threshold
+            for entry_key, entry in list(self._entries.items()):
+                if entry_key[0] != fingerprint or entry["vector"] is None:
+                    continue
+                if self._expired(entry, now):
+                    del self._entries[entry_key]
+                    continue
+                score = float(np.dot(entry["vector"], query_vector))
+                if score >= best_score:
+                    best_key, best_score = entry_key, score
+
+            if best_key is None:
+                self.misses += 1
+                return None, query_vector
+            self._entries.move_to_end(best_key)
+            self.similar_hits += 1
+            return self._entries[best_key]["answer"], query_vector
+
+    def put(self, fingerprint, question, answer, query_vector=None):
+        key = (fingerprint, normalize_question(question))
+        vector = self._unit(query_vector) if query_vector is not None else None
+        with self._lock:
+            self._entries[key] = {"answer": answer, "vector": vector, "created": time.time()}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "exact_hits": self.exact_hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+            }
@@ -1,18 +1,35 @@
+import time
+# Start of this script run, for the first-render time reported at startup
+SCRIPT_STARTED = time.perf_counter()
 import streamlit as st
 from dotenv import load_dotenv
+# Load environment variables before the local modules read their settings
+load_dotenv()
 import os
+import importlib
+import threading
+import hashlib
 import logging
-from PyPDF2 import PdfReader
-from langchain.text_splitter import CharacterTextSplitter
-from langchain_community.embeddings import OpenAIEmbeddings, HuggingFaceInstructEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain_community.chat_models import ChatOpenAI
-
-from langchain.memory import ConversationBufferMemory
-from langchain.chains import ConversationalRetrievalChain
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import AIMessage, HumanMessage
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 from htmlTemplates import css, bot_template, user_template, hide_st_style, footer
-from langchain_huggingface import HuggingFaceEndpoint
-from matplotlib import style
+from answerCache import AnswerCache
+from instrumentation import (
+    METRICS, ChainSpanHandler, Span, new_trace_id, start_metrics_server, tag_chain_stages,
+)
+from indexRegistry import IndexRegistry, copy_vectorstore, get_library_key
+from ingestionPipeline import (
+    HF_EMBEDDING_MODEL, OPENAI_EMBEDDING_MODEL, ProgressReporter, add_document_vectors,
+    get_document_id, get_embedding_model_name, get_vectorstore_model_name, iter_document_vectorstores,
+    has_openai_key, load_embeddings, load_library,
+)
+from vectorIndex import delete_from_vectorstore, get_index_type, optimize_vectorstore
+from requestExecution import RequestCancelled, retry_with_backoff, run_hedged
+from requestScheduler import SCHEDULER
+from textChunker import get_token_counter
+from warmup import WARMUP_ON_START, Warmup
 
 # Configure logging to suppress warnings from libraries
 logging.getLogger("sentence_transformers").setLevel(logging.ERROR)
@@ -23,9 +40,6 @@ logging.getLogger("langchain_community").setLevel(logging.ERROR)
 logging.getLogger("torch").setLevel(logging.ERROR)
 logging.getLogger("huggingface_hub").setLevel(logging.ERROR)
 
-# Load environment variables
-load_dotenv()
-
 # Disable HuggingFace symlinks warning on Windows
 os.environ["HF_HUB_DISABLE_SYMLINKS_WARNING"] = "1"
 # Suppress additional warnings
@@ -54,6 +68,7 @@ warnings.filterwarnings("ignore", message=".*migrating_memory.*")
 warnings.filterwarnings("ignore", message=".*_target_device.*")
 warnings.filterwarnings("ignore", message=".*deprecated.*")
 warnings.filterwarnings("ignore", message=".*ConversationBufferMemory.*")
+warnings.filterwarnings("ignore", message=".*ConversationSummaryBufferMemory.*")
 
 # Check API keys availability (for informational purposes only)
 openai_key = os.getenv("OPENAI_API_KEY")
@@ -61,16 +76,59 @@ hf_token = os.getenv("HUGGINGFACEHUB_API_TOKEN")
 
 # Note: No more automatic warnings - users will choose their processing mode explicitly
 
-
-@st.cache_resource
+# Stream answer tokens into the chat area as they are generated
+STREAM_ANSWERS = os.getenv("STREAM_ANSWERS", "true").lower() == "true"
+# "token_budget" keeps recent turns within a per-backend token budget plus a rolling summary; "buffer" keeps everything
+MEMORY_MODE = os.getenv("MEMORY_MODE", "token_budget")
+HF_MEMORY_TOKEN_BUDGET = int(os.getenv("HF_MEMORY_TOKEN_BUDGET", "200"))
+OPENAI_MEMORY_TOKEN_BUDGET = int(os.getenv("OPENAI_MEMORY_TOKEN_BUDGET", "1500"))
+# Per-request retries with jittered exponential backoff
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "1"))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "10"))
+# Optional second backend that slow requests are also sent to ("", "hf_no_token", "hf_with_token", "local" or "openai")
+HEDGE_BACKEND = os.getenv("HEDGE_BACKEND", "")
+HEDGE_AFTER_SECONDS = float(os.getenv("HEDGE_AFTER_SECONDS", "8"))
+# Library saved by ingest.py --output that every session starts with (memory-mapped, shared across processes)
+SHARED_LIBRARY_PATH = os.getenv("SHARED_LIBRARY_PATH", "")
+# Load the local model during start-up warm-up instead of on first use
+LOCAL_LLM_WARMUP = os.getenv("LOCAL_LLM_WARMUP", "false").lower() == "true"
+# Show per-stage timings in the sidebar
+DEBUG_PANEL = os.getenv("DEBUG_PANEL", "false").lower() == "true"
+
+
+@st.cache_resource(show_spinner=False)
 def get_embeddings_model():
     """Cache the embeddings model to avoid repeated downloads"""
-    return HuggingFaceInstructEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+    return load_embeddings(HF_EMBEDDING_MODEL)
 
 
-@st.cache_resource
-def get_llm_model(processing_mode="hf_no_token"):
+@st.cache_resource(show_spinner=False)
+def get_openai_embeddings():
+    """Share one deduplicating OpenAI embeddings client across sessions"""
+    return load_embeddings(OPENAI_EMBEDDING_MODEL)
+
+
+@st.cache_resource(show_spinner=False)
+def get_local_engine():
+    """Load the local CPU model once and batch generation for every session"""
+    from localLLM import LocalSeq2SeqEngine
+
+    return LocalSeq2SeqEngine().start()
+
+
+@st.cache_resource(show_spinner=False)
+def get_llm_model(processing_mode="hf_no_token", streaming=False):
     """Cache the LLM model to avoid repeated downloads"""
+    if processing_mode == "local":
+        # LangChain's LLM base class imports transformers, so this waits until the mode is used
+        from localLLM import LocalLLM
+
+        return LocalLLM(engine=get_local_engine(), streaming=streaming)
+
+    # Imported on first use: langchain_huggingface pulls in transformers, which takes seconds
+    from langchain_huggingface import HuggingFaceEndpoint
+
     if processing_mode == "hf_with_token":
         hf_token = os.getenv("HUGGINGFACEHUB_API_TOKEN")
     else:
@@ -81,111 +139,264 @@ def get_llm_model(processing_mode="hf_no_token"):
         temperature=0.1,
         max_new_tokens=100,  # Conservative for reliability
         timeout=30,  # Reasonable timeout
+        streaming=streaming,
         huggingfacehub_api_token=hf_token
     )
 
 
-def get_pdf_text(pdf_docs):
-    text = ""
+class StreamlitReporter(ProgressReporter):
+    """Shows ingestion messages in the page and a progress bar per PDF"""
+
+    def __init__(self):
+        self._progress = None
+
+    def info(self, message):
+        st.info(message)
+
+    def success(self, message):
+        st.success(message)
+
+    def warning(self, message):
+        st.warning(message)
+
+    def error(self, message):
+        st.error(message)
+
+    def start_file(self, name, num_pages):
+        self._progress = st.progress(0.0, text=f"Indexing {name}...")
+
+    def page_done(self, name, page_num, num_pages):
+        self._progress.progress((page_num + 1) / num_pages,
+                                text=f"Indexed page {page_num + 1} of {num_pages} ({name})")
+
+    def end_file(self, name):
+        self._progress.empty()
+
+
+def get_embeddings_for(model_name):
+    if model_name == OPENAI_EMBEDDING_MODEL:
+        return get_openai_embeddings()
+    return get_embeddings_model()
+
+
+def get_document_vectorstores(pdfs, processing_mode="hf_no_token"):
+    """Yield (doc ID, PDF, vector store) for {doc ID: PDF} in order, reusing the on-disk index cache when possible"""
+    vectorstores = iter_document_vectorstores(
+        [(pdf.name, pdf.getvalue()) for pdf in pdfs.values()], processing_mode, StreamlitReporter(), get_embeddings_for)
+    for (doc_id, pdf), (_, vectorstore) in zip(pdfs.items(), vectorstores):
+        yield doc_id, pdf, vectorstore
+
+
+@st.cache_resource
+def get_index_registry():
+    """One registry of shared vector stores for the whole Streamlit server"""
+    return IndexRegistry(max_bytes=float(os.getenv("INDEX_REGISTRY_MAX_MB", "2048")) * 1024 * 1024)
+
+
+@st.cache_resource(show_spinner=False)
+def get_shared_library():
+    """Open SHARED_LIBRARY_PATH once per server process; its vectors and texts stay memory-mapped"""
+    return load_library(SHARED_LIBRARY_PATH, get_embeddings_for)
+
+
+def open_shared_library():
+    """Start the session on the shared library, registered like any other so sessions share one handle"""
+    vectorstore, documents, model_name = get_shared_library()
+    registry = get_index_registry()
+    key = get_library_key(documents, model_name)
+    handle = registry.acquire(key) or registry.register(key, vectorstore, documents, model_name)
+    use_library(handle)
+
+
+def reset_document_library():
+    if st.session_state.get("index_handle") is not None:
+        st.session_state.index_handle.release()
+    st.session_state.index_handle = None
+    st.session_state.vectorstore = None
+    st.session_state.index_report = None
+    st.session_state.documents = {}
+    st.session_state.embedding_model = None
+
+
+def use_library(handle):
+    """Switch the session to a shared library handle, releasing the one it held before"""
+    if st.session_state.index_handle is not None:
+        st.session_state.index_handle.release()
+    st.session_state.index_handle = handle
+    st.session_state.vectorstore = handle.vectorstore
+    st.session_state.documents = dict(handle.documents)
+    st.session_state.embedding_model = handle.model_name
+
+    # Keep the chains and their memory, just point their retrievers at the new store
+    for chain in (st.session_state.conversation, st.session_state.hedge_conversation):
+        if chain is not None:
+            chain.retriever.vectorstore = handle.vectorstore
+
+
+def add_documents(pdf_docs, processing_mode="hf_no_token"):
+    """Embed only the PDFs that are not in the session's library yet, sharing identical libraries across sessions"""
+    registry = get_index_registry()
+    model_name = get_embedding_model_name(processing_mode)
+    if st.session_state.vectorstore is not None and st.session_state.embedding_model != model_name:
+        st.warning("⚠️ This processing mode uses a different embedding model - rebuilding your document library...")
+        reset_document_library()
+
+    new_pdfs = {}
     for pdf in pdf_docs:
+        doc_id = get_document_id(pdf.getvalue())
+        if doc_id not in st.session_state.documents:
+            new_pdfs[doc_id] = pdf
+
+    if not new_pdfs:
+        if st.session_state.vectorstore is not None:
+            st.info("📚 All uploaded PDFs are already in your library - nothing new to embed.")
+        return st.session_state.vectorstore
+
+    # Another session may already have exactly this library in memory
+    handle = registry.acquire(get_library_key(list(st.session_state.documents) + list(new_pdfs), model_name))
+    if handle is not None:
+        st.info("♻️ Using the index another session already built for these documents - nothing to embed.")
+        use_library(handle)
+        return handle.vectorstore
+
+    # Shared stores are read-only, so changes go into a private copy that is shared in turn
+    vectorstore = None
+    if st.session_state.vectorstore is not None:
+        vectorstore = copy_vectorstore(st.session_state.vectorstore)
+    documents = dict(st.session_state.documents)
+    library_model = st.session_state.embedding_model
+
+    library_span = Span("index_build", scope="library", trace=new_trace_id())
+    for doc_id, pdf, doc_vectorstore in get_document_vectorstores(new_pdfs, processing_mode):
+        if doc_vectorstore is None:
+            continue
+
+        doc_model = get_vectorstore_model_name(doc_vectorstore)
+        if vectorstore is not None and doc_model != library_model:
+            st.error(f"❌ {pdf.name} was embedded with a different model and cannot be combined with the other documents.")
+            continue
+
+        if vectorstore is None:
+            library_model = doc_model
+        with library_span.measure():
+            vectorstore, chunk_ids = add_document_vectors(vectorstore, doc_vectorstore, doc_id, pdf.name)
+        documents[doc_id] = {"name": pdf.name, "chunk_ids": chunk_ids}
+
+    if vectorstore is None:
+        library_span.finish()
+        return None
+
+    # Large libraries move to an approximate index, trained here rather than at query time
+    with library_span.measure():
+        report = optimize_vectorstore(vectorstore)
+    library_span.add(documents=len(new_pdfs), vectors=vectorstore.index.ntotal)
+    library_span.finish()
+    if report is not None:
+        st.session_state.index_report = report
+        st.info(f"🧭 Switched to a {report['index_type'].upper()} index for {report['vectors']} chunks: "
+                f"recall@{report['k']} {report['recall_at_k']:.0%} vs exact search, "
+                f"{report['query_ms']:.2f} ms vs {report['flat_query_ms']:.2f} ms per query")
+
+    handle = registry.register(get_library_key(documents, library_model), vectorstore, documents, library_model)
+    use_library(handle)
+    return handle.vectorstore
+
+
+def remove_document(doc_id):
+    """Drop one document's chunks from the session's library by its source ID"""
+    document = st.session_state.documents.get(doc_id)
+    if document is None:
+        return
+
+    documents = {other_id: other for other_id, other in st.session_state.documents.items() if other_id != doc_id}
+    if not documents:
+        reset_document_library()
+        st.session_state.conversation = None
+        st.session_state.hedge_conversation = None
+        return
+
+    registry = get_index_registry()
+    key = get_library_key(documents, st.session_state.embedding_model)
+    handle = registry.acquire(key)
+    if handle is None:
+        vectorstore = copy_vectorstore(st.session_state.vectorstore)
+        delete_from_vectorstore(vectorstore, document["chunk_ids"])
+        handle = registry.register(key, vectorstore, documents, st.session_state.embedding_model)
+    use_library(handle)
+
+
+def get_conversation_memory(llm, processing_mode="hf_no_token"):
+    """Chat memory for a backend: recent turns within a token budget plus a rolling summary of older ones"""
+    from langchain.memory import ConversationBufferMemory
+
+    from contextPacker import get_llm_token_counter
+    from conversationMemory import TokenBudgetMemory
+
+    if MEMORY_MODE == "buffer":
+        return ConversationBufferMemory(
+            memory_key='chat_history', return_messages=True)
+
+    # flan-t5-small only sees ~512 tokens, so its history budget is far smaller than gpt-3.5-turbo's
+    budget = OPENAI_MEMORY_TOKEN_BUDGET if processing_mode == "openai" else HF_MEMORY_TOKEN_BUDGET
+    return TokenBudgetMemory(
+        llm=llm,
+        token_counter=get_llm_token_counter(processing_mode),
+        backend=processing_mode,
+        max_retries=LLM_MAX_RETRIES,
+        base_delay=LLM_BACKOFF_BASE_SECONDS,
+        max_delay=LLM_BACKOFF_MAX_SECONDS,
+        max_token_limit=budget,
+        memory_key='chat_history',
+        return_messages=True
+    )
+
+
+def get_condense_chain(condense_llm):
+    """Question condenser for CONDENSE_MODE; "local" swaps in the local CPU model when it loads"""
+    from questionCondenser import CONDENSE_MODE, build_condense_chain
+
+    strategy = CONDENSE_MODE
+    if strategy == "local":
         try:
-            pdf_reader = PdfReader(pdf)
-            st.info(f"Processing PDF: {pdf.name} ({len(pdf_reader.pages)} pages)")
-            
-            for page_num, page in enumerate(pdf_reader.pages):
-                page_text = page.extract_text()
-                if page_text:
-                    text += page_text
-                else:
-                    st.warning(f"No text found on page {page_num + 1} of {pdf.name}")
-                    
+            condense_llm = get_llm_model("local")
         except Exception as e:
-            st.error(f"Error reading PDF {pdf.name}: {str(e)}")
-            
-    if not text.strip():
-        st.error("No readable text found in any of the uploaded PDF files.")
-        return ""
-    
-    st.success(f"Extracted {len(text)} characters from PDF files.")
-    return text
+            st.warning(f"⚠️ Could not load the local model for question condensing, using the answering model: {str(e)}")
+            strategy = "llm"
+    return build_condense_chain(condense_llm, strategy)
 
 
-def get_text_chunks(text):
-    if not text or len(text.strip()) == 0:
-        st.error("No text found in the PDF files. Please check if the PDFs contain readable text.")
-        return []
-    
-    text_splitter = CharacterTextSplitter(
-        separator="\n",
-        chunk_size=1000,
-        chunk_overlap=200,
-        length_function=len
-    )
-    chunks = text_splitter.split_text(text)
-    
-    if not chunks:
-        st.error("No text chunks created. The PDF might be empty or unreadable.")
-        return []
-    
-    st.info(f"Created {len(chunks)} text chunks for processing.")
-    return chunks
+def build_retrieval_chain(llm, condense_llm, vectorstore, processing_mode, memory=None):
+    """Retrieval chain with the configured condensing strategy and context packing, tagged for stage spans"""
+    from langchain.chains import ConversationalRetrievalChain
 
+    from contextPacker import get_retriever
 
-def get_vectorstore(text_chunks, processing_mode="hf_no_token"):
-    if not text_chunks:
-        st.error("No text chunks available to create vector store.")
-        return None
-    
-    try:
-        # Determine which embeddings to use based on user choice
-        if processing_mode == "openai":
-            # Try OpenAI embeddings first
-            if os.getenv("OPENAI_API_KEY") and os.getenv("OPENAI_API_KEY") != "your_openai_api_key_here":
-                try:
-                    embeddings = OpenAIEmbeddings()
-                    st.info(f"🚀 Using OpenAI embeddings (user selected) - creating vector store from {len(text_chunks)} text chunks...")
-                    vectorstore = FAISS.from_texts(texts=text_chunks, embedding=embeddings)
-                    st.success("✅ Vector store created successfully with OpenAI embeddings!")
-                    return vectorstore
-                except Exception as openai_error:
-                    if "quota" in str(openai_error).lower() or "429" in str(openai_error):
-                        st.error("❌ OpenAI quota exceeded! Falling back to HuggingFace embeddings...")
-                    else:
-                        st.error(f"❌ OpenAI error: {str(openai_error)}. Falling back to HuggingFace embeddings...")
-            else:
-                st.error("❌ No valid OpenAI API key found! Please add it to your .env file or choose a different processing mode.")
-                st.info("💡 Switching to HuggingFace embeddings...")
-        
-        # Use HuggingFace embeddings (free) - works with or without token
-        st.info("🤗 Using free HuggingFace embeddings (cached - faster after first run)...")
-        embeddings = get_embeddings_model()  # Use cached model
-        
-        st.info(f"🔄 Creating vector store from {len(text_chunks)} text chunks...")
-        vectorstore = FAISS.from_texts(texts=text_chunks, embedding=embeddings)
-        st.success("✅ Vector store created successfully with HuggingFace embeddings!")
-        return vectorstore
-        
-    except Exception as e:
-        st.error(f"❌ Error creating vector store: {str(e)}")
-        return None
+    chain = ConversationalRetrievalChain.from_llm(
+        llm=llm,
+        condense_question_llm=condense_llm,
+        retriever=get_retriever(vectorstore, processing_mode),
+        memory=memory
+    )
+    chain.question_generator = get_condense_chain(condense_llm)
+    return tag_chain_stages(chain)
 
 
 def get_conversation_chain(vectorstore, processing_mode="hf_no_token"):
     try:
         # Handle OpenAI mode
         if processing_mode == "openai":
-            if os.getenv("OPENAI_API_KEY") and os.getenv("OPENAI_API_KEY") != "your_openai_api_key_here":
+            if has_openai_key():
                 try:
-                    llm = ChatOpenAI(model_name="gpt-3.5-turbo", temperature=0)
+                    # Only the selected provider's client library gets imported
+                    from langchain_community.chat_models import ChatOpenAI
+
+                    llm = ChatOpenAI(model_name="gpt-3.5-turbo", temperature=0, streaming=STREAM_ANSWERS)
+                    # Question condensing stays non-streaming so only the answer reaches the chat area
+                    condense_llm = ChatOpenAI(model_name="gpt-3.5-turbo", temperature=0)
                     st.info("🚀 Using OpenAI ChatGPT for conversations (user selected)...")
                     
-                    memory = ConversationBufferMemory(
-                        memory_key='chat_history', return_messages=True)
-                    conversation_chain = ConversationalRetrievalChain.from_llm(
-                        llm=llm,
-                        retriever=vectorstore.as_retriever(),
-                        memory=memory
-                    )
+                    memory = get_conversation_memory(condense_llm, processing_mode)
+                    conversation_chain = build_retrieval_chain(llm, condense_llm, vectorstore, processing_mode, memory)
                     st.success("✅ Conversation system ready with OpenAI!")
                     return conversation_chain
                     
@@ -198,6 +409,20 @@ def get_conversation_chain(vectorstore, processing_mode="hf_no_token"):
                 st.error("❌ No valid OpenAI API key found! Please add it to your .env file or choose a different processing mode.")
                 st.info("💡 Switching to HuggingFace model...")
         
+        # Handle the local CPU mode
+        if processing_mode == "local":
+            try:
+                st.info("💻 Using the local CPU model (loaded once, shared by all sessions)...")
+                llm = get_llm_model(processing_mode, streaming=STREAM_ANSWERS)
+                condense_llm = get_llm_model(processing_mode)
+                memory = get_conversation_memory(condense_llm, processing_mode)
+                conversation_chain = build_retrieval_chain(llm, condense_llm, vectorstore, processing_mode, memory)
+                st.success("✅ Conversation system ready with the local CPU model!")
+                return conversation_chain
+            except Exception as local_error:
+                st.error(f"❌ Could not load the local model: {str(local_error)}. Falling back to HuggingFace model...")
+                processing_mode = "hf_no_token"
+
         # Handle HuggingFace modes (with or without token)
         if processing_mode == "hf_with_token":
             st.info("🤗 Using HuggingFace model with API token for faster responses (cached)...")
@@ -211,15 +436,11 @@ def get_conversation_chain(vectorstore, processing_mode="hf_no_token"):
             st.info("🤗 Using HuggingFace model with public inference (cached - faster after first run)...")
         
         # Use cached HuggingFace model
-        llm = get_llm_model(processing_mode)
+        llm = get_llm_model(processing_mode, streaming=STREAM_ANSWERS)
+        condense_llm = get_llm_model(processing_mode)
         
-        memory = ConversationBufferMemory(
-            memory_key='chat_history', return_messages=True)
-        conversation_chain = ConversationalRetrievalChain.from_llm(
-            llm=llm,
-            retriever=vectorstore.as_retriever(),
-            memory=memory
-        )
+        memory = get_conversation_memory(condense_llm, processing_mode)
+        conversation_chain = build_retrieval_chain(llm, condense_llm, vectorstore, processing_mode, memory)
         
         if processing_mode == "hf_with_token" and hf_token:
             st.success("✅ Conversation system ready with HuggingFace (with token - faster responses)!")
@@ -234,50 +455,240 @@ def get_conversation_chain(vectorstore, processing_mode="hf_no_token"):
         return None
 
 
+def get_hedge_chain(vectorstore, processing_mode="hf_no_token"):
+    """Build the memory-less chain that hedged requests are sent to, or None when hedging is off"""
+    if not HEDGE_BACKEND or HEDGE_BACKEND == processing_mode:
+        return None
+
+    try:
+        if HEDGE_BACKEND == "openai":
+            if not has_openai_key():
+                return None
+            from langchain_community.chat_models import ChatOpenAI
+
+            llm = ChatOpenAI(model_name="gpt-3.5-turbo", temperature=0, streaming=STREAM_ANSWERS)
+            condense_llm = ChatOpenAI(model_name="gpt-3.5-turbo", temperature=0)
+        elif HEDGE_BACKEND in ("hf_no_token", "hf_with_token", "local"):
+            if HEDGE_BACKEND == "hf_with_token" and not os.getenv("HUGGINGFACEHUB_API_TOKEN"):
+                return None
+            llm = get_llm_model(HEDGE_BACKEND, streaming=STREAM_ANSWERS)
+            condense_llm = get_llm_model(HEDGE_BACKEND)
+        else:
+            return None
+
+        return build_retrieval_chain(llm, condense_llm, vectorstore, HEDGE_BACKEND)
+    except Exception as e:
+        st.warning(f"⚠️ Hedged requests disabled - could not set up {HEDGE_BACKEND}: {str(e)}")
+        return None
+
+
+@st.cache_resource
+def get_answer_cache():
+    """Share one answer cache across all sessions"""
+    return AnswerCache(
+        max_entries=int(os.getenv("ANSWER_CACHE_SIZE", "512")),
+        ttl_seconds=float(os.getenv("ANSWER_CACHE_TTL", "3600")),
+        similarity_threshold=float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.92"))
+    )
+
+
+def get_index_fingerprint():
+    """Identify the session's document set, embedding model and answering backend"""
+    digest = hashlib.sha256()
+    parts = [st.session_state.embedding_model or "", st.session_state.conversation_mode or ""]
+    for part in parts + sorted(st.session_state.documents):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class StreamHandler(BaseCallbackHandler):
+    """Write answer tokens into a chat placeholder as the LLM streams them"""
+
+    # Let RequestCancelled abort the losing leg of a hedged request mid-stream
+    raise_error = True
+
+    def __init__(self, placeholder, request=None, leg_name=None):
+        self.placeholder = placeholder
+        self.request = request
+        self.leg_name = leg_name
+        self.first_token_at = None
+        self.text = ""
+
+    def on_llm_new_token(self, token, **kwargs):
+        # The first leg to stream owns the chat area; the other one is cancelled
+        if self.request is not None and not self.request.claim(self.leg_name):
+            raise RequestCancelled(self.leg_name)
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        self.text += token
+        self.placeholder.write(bot_template.replace(
+            "{{MSG}}", self.text + "▌"), unsafe_allow_html=True)
+
+
+def render_chat_history(messages):
+    for i, message in enumerate(messages):
+        if i % 2 == 0:
+            st.write(user_template.replace(
+                "{{MSG}}", message.content), unsafe_allow_html=True)
+        else:
+            st.write(bot_template.replace(
+                "{{MSG}}", message.content), unsafe_allow_html=True)
+
+
+def record_turn(conversation, formatted_question, answer):
+    """Save a turn to the on-screen transcript and to the chain memory (which may prune or summarize it)"""
+    st.session_state.chat_history = (st.session_state.chat_history or []) + [
+        HumanMessage(content=formatted_question), AIMessage(content=answer)]
+    conversation.memory.save_context({'question': formatted_question}, {'answer': answer})
+
+
+def record_turn_metrics(question, started_at, conversation, first_token_at=None, cached=False, condense_time=0.0):
+    """Keep time-to-first-token, question-condensing time and total generation time for each answered turn"""
+    finished_at = time.perf_counter()
+    metrics = {
+        "question": question,
+        "cached": cached,
+        # The strategy the chain runs, which is "llm" when the local condensing model failed to load
+        "condense_mode": conversation.question_generator.strategy,
+        "condense_time": condense_time,
+        "time_to_first_token": (first_token_at or finished_at) - started_at,
+        "total_time": finished_at - started_at,
+    }
+    st.session_state.turn_metrics.append(metrics)
+    return metrics
+
+
+def ask_conversation(formatted_question, answer_placeholder):
+    """Answer one question with backoff retries, hedging to a second backend when configured.
+
+    Returns (backend name, (response, first token time, seconds spent condensing the question))
+    from whichever backend answered first.
+    """
+    from contextPacker import get_llm_token_counter
+
+    conversation = st.session_state.conversation
+    history = conversation.memory.load_memory_variables({})['chat_history']
+
+    legs = [(st.session_state.conversation_mode, conversation)]
+    if st.session_state.hedge_conversation is not None:
+        legs.append((HEDGE_BACKEND, st.session_state.hedge_conversation))
+
+    trace = new_trace_id()
+    # Sessions asking the same thing of the same documents at the same time share one LLM call
+    call_key = (get_index_fingerprint(), formatted_question, str(history))
+
+    def make_leg(chain):
+        stateless_chain = chain.model_copy(update={"memory": None})
+
+        def run_leg(request, leg_name):
+            def attempt():
+                stream_handler = StreamHandler(answer_placeholder, request, leg_name)
+                span_handler = ChainSpanHandler(get_llm_token_counter(leg_name), trace=trace, backend=leg_name)
+                response = SCHEDULER.run(
+                    leg_name,
+                    lambda: stateless_chain.invoke(
+                        {'question': formatted_question, 'chat_history': history},
+                        config={"callbacks": [stream_handler, span_handler]}),
+                    key=call_key,
+                    cancel_event=request.cancel_event(leg_name))
+                request.check(leg_name)
+                return response, stream_handler.first_token_at, span_handler.condense_seconds
+
+            def on_retry(attempt_number, max_retries, error, delay):
+                if isinstance(error, StopIteration):
+                    st.warning(f"⚠️ Model didn't respond (attempt {attempt_number}/{max_retries}). Retrying in {delay:.1f} s...")
+                else:
+                    st.warning(f"⚠️ Error occurred (attempt {attempt_number}/{max_retries}): {str(error)}. Retrying in {delay:.1f} s...")
+
+            return retry_with_backoff(
+                attempt,
+                max_retries=LLM_MAX_RETRIES,
+                base_delay=LLM_BACKOFF_BASE_SECONDS,
+                max_delay=LLM_BACKOFF_MAX_SECONDS,
+                cancel_event=request.cancel_event(leg_name),
+                on_retry=on_retry
+            )
+        return run_leg
+
+    # Worker threads need the script context to write into the page
+    ctx = get_script_run_ctx()
+    return run_hedged(
+        [(name, make_leg(chain)) for name, chain in legs],
+        hedge_after=HEDGE_AFTER_SECONDS,
+        initializer=lambda: add_script_run_ctx(threading.current_thread(), ctx)
+    )
+
+
 def handle_userinput(user_question):
+    if st.session_state.conversation is None and st.session_state.vectorstore is not None:
+        # A session on the shared library has documents before it ever clicks Process
+        st.session_state.conversation = get_conversation_chain(
+            st.session_state.vectorstore, st.session_state.processing_mode)
+        st.session_state.conversation_mode = st.session_state.processing_mode
+        st.session_state.hedge_conversation = get_hedge_chain(
+            st.session_state.vectorstore, st.session_state.processing_mode)
     if st.session_state.conversation is None:
         st.error("Please upload PDF data before starting the chat.")
         return
 
+    from questionCondenser import QUESTION_PREFIX
+
+    conversation = st.session_state.conversation
+    # Format the question better for the model
+    formatted_question = f"{QUESTION_PREFIX} {user_question}"
+
+    # Only standalone questions are shared; follow-ups depend on this session's chat history
+    answer_cache = get_answer_cache()
+    fingerprint = get_index_fingerprint()
+    standalone = not conversation.memory.load_memory_variables({})['chat_history']
+    cached_answer, query_vector = None, None
+    if standalone:
+        try:
+            cached_answer, query_vector = answer_cache.get(
+                fingerprint, user_question, st.session_state.vectorstore.embeddings.embed_query)
+        except Exception:
+            cached_answer, query_vector = None, None
+
+    # Earlier turns first, then the new question with a placeholder the answer streams into
+    render_chat_history(st.session_state.chat_history or [])
+    st.write(user_template.replace("{{MSG}}", formatted_question), unsafe_allow_html=True)
+    answer_placeholder = st.empty()
+    started_at = time.perf_counter()
+
     try:
-        with st.spinner("Thinking..."):
-            # Try to get response with retries
-            max_retries = 3
-            for attempt in range(max_retries):
-                try:
-                    # Format the question better for the model
-                    formatted_question = f"Based on the document context, please answer: {user_question}"
-                    response = st.session_state.conversation.invoke({'question': formatted_question})
-                    st.session_state.chat_history = response['chat_history']
-                    break  # Success, exit retry loop
-                except StopIteration:
-                    if attempt < max_retries - 1:
-                        st.warning(f"⚠️ Model didn't respond (attempt {attempt + 1}/{max_retries}). Retrying...")
-                        continue
-                    else:
-                        st.error("❌ The AI model is not responding. This often happens with HuggingFace public inference during high traffic.")
-                        st.info("💡 **Try these solutions:**")
-                        st.info("1. Wait a few minutes and try again")
-                        st.info("2. Try a shorter, simpler question")  
-                        st.info("3. Get a free HuggingFace API token for more reliable responses")
-                        st.info("4. Switch to OpenAI if you have credits")
-                        return
-                except Exception as e:
-                    if attempt < max_retries - 1:
-                        st.warning(f"⚠️ Error occurred (attempt {attempt + 1}/{max_retries}): {str(e)}")
-                        continue
-                    else:
-                        raise e  # Re-raise the last exception
+        if cached_answer is not None:
+            # Record the cached turn so follow-up questions still see it
+            record_turn(conversation, formatted_question, cached_answer)
+            answer = cached_answer
+            metrics = record_turn_metrics(user_question, started_at, conversation, cached=True)
+        else:
+            with st.spinner("Thinking..."):
+                leg_name, (response, first_token_at, condense_time) = ask_conversation(
+                    formatted_question, answer_placeholder)
+            answering_chain = conversation
+            if leg_name != st.session_state.conversation_mode:
+                answering_chain = st.session_state.hedge_conversation
+                st.caption(f"🏁 Answered by the hedged backend ({leg_name})")
+
+            answer = response['answer']
+            if standalone:
+                answer_cache.put(fingerprint, user_question, answer, query_vector)
+            # Chains run without memory so hedged legs cannot both record the turn
+            record_turn(conversation, formatted_question, answer)
+            metrics = record_turn_metrics(
+                user_question, started_at, answering_chain, first_token_at, condense_time=condense_time)
+
+        answer_placeholder.write(bot_template.replace(
+            "{{MSG}}", answer), unsafe_allow_html=True)
+        if metrics["cached"]:
+            st.caption(f"⚡ Answered from cache in {metrics['total_time']:.2f} s")
+        else:
+            condensed = (f" · question condensed in {metrics['condense_time']:.1f} s"
+                         if metrics["condense_time"] else "")
+            st.caption(f"⏱️ First token after {metrics['time_to_first_token']:.1f} s · "
+                       f"answer complete in {metrics['total_time']:.1f} s{condensed}")
 
-        # Display conversation history
-        for i, message in enumerate(st.session_state.chat_history):
-            if i % 2 == 0:
-                st.write(user_template.replace(
-                    "{{MSG}}", message.content), unsafe_allow_html=True)
-            else:
-                st.write(bot_template.replace(
-                    "{{MSG}}", message.content), unsafe_allow_html=True)
-                    
     except StopIteration:
         st.error("❌ The AI model stopped generating a response unexpectedly.")
         st.info("💡 **This is a common issue with free HuggingFace inference. Try:**")
@@ -297,8 +708,72 @@ def handle_userinput(user_question):
             st.info(f"🔧 **Debug info**: {type(e).__name__}: {str(e)}")
 
 
+@st.cache_resource
+def get_metrics_server():
+    """Start the Prometheus endpoint once per server process (a no-op unless METRICS_PORT is set)"""
+    return start_metrics_server()
+
+
+def render_debug_panel():
+    """Sidebar table of where time has gone, per pipeline stage, across all sessions"""
+    with st.sidebar.expander("🔬 Stage timings", expanded=False):
+        summary = METRICS.summary()
+        if not summary:
+            st.caption("No stages recorded yet - process a PDF or ask a question.")
+            return
+        st.table([
+            {
+                "stage": name,
+                "runs": stage["count"],
+                "total s": round(stage["seconds"], 2),
+                "mean ms": round(stage["mean_ms"], 1),
+                "items": ", ".join(f"{item}={value}" for item, value in sorted(stage["counts"].items())),
+                "last RSS Δ MB": round(stage["rss_delta_bytes"] / (1024 * 1024), 1),
+            }
+            for name, stage in sorted(summary.items())
+        ])
+        scheduler_stats = SCHEDULER.stats()
+        if scheduler_stats:
+            st.caption("Request scheduler")
+            st.table([{"backend": name, **backend} for name, backend in scheduler_stats.items()])
+        st.caption("Most recent spans")
+        st.json(list(METRICS.recent)[-10:], expanded=False)
+
+
+def _warm_up_tokenizers():
+    from contextPacker import get_llm_token_counter
+
+    get_token_counter(HF_EMBEDDING_MODEL)
+    get_llm_token_counter("hf_no_token")
+
+
+def _warm_up_imports():
+    # The modules the default HuggingFace mode needs on its first question
+    for module in ("langchain.chains", "langchain.memory", "langchain_huggingface", "questionCondenser", "contextPacker"):
+        importlib.import_module(module)
+
+
+@st.cache_resource(show_spinner=False)
+def get_warmup():
+    """Load the default mode's models on a background thread, once per server process"""
+    steps = [
+        ("imports", _warm_up_imports),
+        ("embeddings", lambda: get_embeddings_model().embed_query("warm-up")),
+        ("tokenizer", _warm_up_tokenizers),
+        ("llm", lambda: (get_llm_model("hf_no_token", streaming=STREAM_ANSWERS), get_llm_model("hf_no_token"))),
+    ]
+    if LOCAL_LLM_WARMUP:
+        steps.append(("local_llm", get_local_engine))
+    if has_openai_key():
+        steps.append(("openai", lambda: (importlib.import_module("langchain_community.chat_models"),
+                                         get_openai_embeddings())))
+    return Warmup(steps).start()
+
+
 def main():
     load_dotenv()
+    get_metrics_server()
+    warmup = get_warmup() if WARMUP_ON_START else None
     st.set_page_config(page_title="Talk with PDF",
                        page_icon="icon.png")
     st.write(css, unsafe_allow_html=True)
@@ -307,8 +782,22 @@ def main():
         st.session_state.conversation = None
     if "chat_history" not in st.session_state:
         st.session_state.chat_history = None
+    if "turn_metrics" not in st.session_state:
+        st.session_state.turn_metrics = []
     if "processing_mode" not in st.session_state:
         st.session_state.processing_mode = "hf_no_token"  # Default to free mode
+    if "conversation_mode" not in st.session_state:
+        st.session_state.conversation_mode = None
+    if "hedge_conversation" not in st.session_state:
+        st.session_state.hedge_conversation = None
+    if "documents" not in st.session_state:
+        st.session_state.index_handle = None
+        reset_document_library()
+        if SHARED_LIBRARY_PATH:
+            try:
+                open_shared_library()
+            except Exception as e:
+                st.error(f"❌ Could not open the shared library at {SHARED_LIBRARY_PATH}: {str(e)}")
 
     st.header("Chat with AI with Custom Data 🚀")
     user_question = st.text_input("Ask a question about your Data:")
@@ -334,42 +823,48 @@ def main():
                 processing_options = {
                     "hf_no_token": "🆓 HuggingFace NO Token (FREE **DEFAULT** - slowest)",
                     "hf_with_token": "⚡ HuggingFace Token (FREE requires HF API token - faster)", 
+                    "local": "💻 Local CPU model (FREE - no network, runs on this server)",
                     "openai": "💨 OpenAI API Key (PAY PER USE - faster than HF API token)"
                 }
                 
                 with st.spinner(f"Processing with {processing_options[st.session_state.processing_mode]}..."):
-                    # Extract text from PDFs
-                    raw_text = get_pdf_text(pdf_docs)
-                    
-                    if not raw_text:
-                        st.error("No text could be extracted from the uploaded PDFs.")
-                        st.stop()
-                    
-                    # Create text chunks
-                    text_chunks = get_text_chunks(raw_text)
-                    
-                    if not text_chunks:
-                        st.error("No text chunks could be created.")
-                        st.stop()
-                    
-                    # Create vector store with selected processing mode
-                    vectorstore = get_vectorstore(text_chunks, st.session_state.processing_mode)
+                    # Extract, chunk and embed only the PDFs that are new to this session
+                    vectorstore = add_documents(pdf_docs, st.session_state.processing_mode)
                     
                     if vectorstore is None:
                         st.error("Failed to create vector store.")
                         st.stop()
                     
-                    # Create conversation chain with selected processing mode
-                    conversation = get_conversation_chain(vectorstore, st.session_state.processing_mode)
+                    if (st.session_state.conversation is None
+                            or st.session_state.conversation_mode != st.session_state.processing_mode):
+                        # Create conversation chain with selected processing mode
+                        conversation = get_conversation_chain(vectorstore, st.session_state.processing_mode)
+                        
+                        if conversation is None:
+                            st.error("Failed to create conversation system.")
+                            st.stop()
+                        
+                        st.session_state.conversation = conversation
+                        st.session_state.conversation_mode = st.session_state.processing_mode
+                        st.session_state.hedge_conversation = get_hedge_chain(vectorstore, st.session_state.processing_mode)
                     
-                    if conversation is None:
-                        st.error("Failed to create conversation system.")
-                        st.stop()
-                    
-                    st.session_state.conversation = conversation
                     st.balloons()
                     st.success(f"🎉 Your Data has been processed successfully using {processing_options[st.session_state.processing_mode]}!")
 
+        # Document Library Section
+        if st.session_state.documents:
+            st.markdown("---")
+            st.markdown("### **Your Library**")
+            for doc_id, document in list(st.session_state.documents.items()):
+                name_col, remove_col = st.columns([5, 1])
+                name_col.write(f"📄 {document['name']} ({len(document['chunk_ids'])} chunks)")
+                if remove_col.button("🗑️", key=f"remove_{doc_id}", help=f"Remove {document['name']} from the library"):
+                    remove_document(doc_id)
+                    st.rerun()
+            if st.session_state.vectorstore is not None:
+                index_type = get_index_type(st.session_state.vectorstore.index)
+                st.caption(f"🧭 {st.session_state.vectorstore.index.ntotal} chunks in a {index_type.upper()} index")
+
         # Processing Configuration Section
         st.markdown("---")
         st.markdown("### **Configure Processing**")
@@ -378,6 +873,7 @@ def main():
         processing_options = {
             "hf_no_token": "HuggingFace NO Token (FREE **DEFAULT** - slow)",
             "hf_with_token": "HuggingFace API Token (FREE - fast)", 
+            "local": "Local CPU model (FREE - no network)",
             "openai": "OpenAI API Key (PAY ¢ PER USE - faster)"
         }
         
@@ -398,9 +894,11 @@ def main():
         elif selected_mode == "hf_with_token":
             if not os.getenv("HUGGINGFACEHUB_API_TOKEN"):
                 st.warning("⚠️ No HuggingFace token found in .env file!")
+        elif selected_mode == "local":
+            st.info("💻 **Runs on this server:**\n- No network calls or public endpoint queue\n- First use loads the model (~300 MB download once)")
         elif selected_mode == "openai":
             st.info("💳 **OpenAI Account Required:**\n- Costs ~$0.002 per response\n- Fastest response time: ~2-8 seconds")
-            if not os.getenv("OPENAI_API_KEY") or os.getenv("OPENAI_API_KEY") == "your_openai_api_key_here":
+            if not has_openai_key():
                 st.warning("⚠️ No OpenAI API key found in .env file!")
                 st.info("🔑 Add `OPENAI_API_KEY=your_key` to .env file")
 
@@ -410,13 +908,40 @@ def main():
         processing_options = {
             "hf_no_token": "🆓 HuggingFace NO Token (FREE **DEFAULT** - slowest)",
             "hf_with_token": "⚡ HuggingFace Token (FREE requires HF API token - faster)", 
+            "local": "💻 Local CPU model (FREE - no network, runs on this server)",
             "openai": "💨 OpenAI API Key (PAY PER USE - faster than HF API token)"
         }
         st.sidebar.success(f"✅ Ready with: {processing_options[current_mode]}")
 
+    if warmup is not None:
+        status = warmup.status()
+        if status["ready"]:
+            st.sidebar.caption(f"🔥 Models warmed up in {status['total_seconds']:.1f} s after start")
+        else:
+            st.sidebar.caption("🔥 Warming up models in the background...")
+
+    registry_stats = get_index_registry().stats()
+    st.sidebar.caption(
+        f"🗂️ Shared indexes: {registry_stats['indexes']} loaded ({registry_stats['in_use']} in use) · "
+        f"{registry_stats['bytes'] / (1024 * 1024):.1f} MB · {registry_stats['hits']} reused"
+    )
+
+    cache_stats = get_answer_cache().stats()
+    st.sidebar.caption(
+        f"⚡ Answer cache: {cache_stats['exact_hits'] + cache_stats['similar_hits']} hits "
+        f"({cache_stats['similar_hits']} similar) · {cache_stats['misses']} misses · "
+        f"{cache_stats['entries']} stored"
+    )
+
     if user_question:
         handle_userinput(user_question)
 
+    if DEBUG_PANEL:
+        render_debug_panel()
+
+    if warmup is not None:
+        warmup.record_first_render(time.perf_counter() - SCRIPT_STARTED)
+
     st.markdown(hide_st_style, unsafe_allow_html=True)
     st.markdown(footer, unsafe_allow_html=True)
 
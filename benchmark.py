@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+"""
+Offline, CPU-only benchmark of the PDF question-answering pipeline.
+
+Generates a synthetic PDF corpus, then times each stage on its own (extract, split,
+embed, index, retrieve, answer) plus the streaming ingestion path the app uses, with a
+stub embedder (or the real local HuggingFace model) and a stub LLM. Results are JSON
+with wall time, throughput and peak memory per stage, optionally compared to a baseline.
+
+    python benchmark.py --pdfs 4 --pages 50 --save-baseline baseline.json
+    python benchmark.py --pdfs 4 --pages 50 --baseline baseline.json
+    python benchmark.py --parity onnx_int8
+    python benchmark.py --llm-latency 2 --condense heuristic
+"""
+
+import argparse
+import atexit
+import hashlib
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import warnings
+
+import numpy as np
+from dotenv import load_dotenv
+
+# Load environment variables before the pipeline reads its settings
+load_dotenv()
+# A private page text cache, emptied before each extraction stage that should really extract
+BENCHMARK_PAGE_CACHE_DIR = tempfile.mkdtemp(prefix="benchmark-pages-")
+os.environ["PAGE_TEXT_CACHE_DIR"] = BENCHMARK_PAGE_CACHE_DIR
+atexit.register(shutil.rmtree, BENCHMARK_PAGE_CACHE_DIR, ignore_errors=True)
+
+from langchain.chains import ConversationalRetrievalChain
+from langchain.memory import ConversationBufferMemory
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.fake import FakeListLLM
+
+from contextPacker import CONTEXT_PACKING, get_retriever
+from embeddingBatcher import DedupBatchEmbeddings
+from ingestionPipeline import (
+    HF_EMBEDDING_MODEL, HF_EMBED_BATCH_SIZE, build_vectorstore, iter_page_texts, iter_text_chunks, load_embeddings,
+)
+from instrumentation import current_rss_bytes
+from pdfExtraction import extract_pdf_pages, get_extractor_names
+from quantizedEmbeddings import EMBEDDING_ENGINE, INT8_ENGINES, check_retrieval_parity
+from questionCondenser import CONDENSE_MODE, build_condense_chain
+from textChunker import PageText
+from vectorIndex import optimize_vectorstore
+
+# After the imports, since LangChain resets its deprecation warning filters when loaded
+warnings.filterwarnings("ignore", message=".*migrating_memory.*")
+
+STUB_EMBEDDING_DIM = 384
+
+
+class StubEmbeddings(Embeddings):
+    """Deterministic hash-seeded vectors: no model download and near-zero cost per text"""
+
+    model_name = "stub-embeddings"
+
+    def __init__(self, dim=STUB_EMBEDDING_DIM):
+        self.dim = dim
+
+    def _embed(self, text):
+        seed = int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:8], "little")
+        return np.random.default_rng(seed).standard_normal(self.dim, dtype=np.float32).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+class StubLLM(FakeListLLM):
+    """Canned answers after a fixed delay, standing in for a remote model's round trip"""
+
+    latency: float = 0.0
+
+    def _call(self, *args, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        return super()._call(*args, **kwargs)
+
+
+def make_pdf(pages):
+    """Minimal multi-page PDF with one Helvetica text block per page"""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>"]
+    kids = " ".join(f"{3 + 2 * i} 0 R" for i in range(len(pages)))
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {len(pages)} >>")
+    font_id = 3 + 2 * len(pages)
+    for i, text in enumerate(pages):
+        lines = " ".join(f"({line}) Tj T*" for line in text.split("\n"))
+        stream = f"BT /F1 10 Tf 50 750 Td 12 TL {lines} ET"
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {4 + 2 * i} 0 R "
+                       f"/Resources << /Font << /F1 {font_id} 0 R >> >> >>")
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+    objects.append("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    out = "%PDF-1.4\n"
+    offsets = []
+    for i, obj in enumerate(objects):
+        offsets.append(len(out))
+        out += f"{i + 1} 0 obj\n{obj}\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n"
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets)
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF"
+    return out.encode("latin-1")
+
+
+def make_corpus(num_pdfs, pages_per_pdf, chars_per_page, seed=0):
+    """Synthetic (name, bytes) PDFs of pseudo-word text, reproducible for a given seed"""
+    rng = random.Random(seed)
+    vocabulary = ["".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(3, 10)))
+                  for _ in range(5000)]
+    corpus = []
+    for doc in range(num_pdfs):
+        pages = []
+        for _ in range(pages_per_pdf):
+            lines, line, size = [], [], 0
+            while size < chars_per_page:
+                word = rng.choice(vocabulary)
+                line.append(word)
+                size += len(word) + 1
+                if len(line) == 12:
+                    lines.append(" ".join(line))
+                    line = []
+            lines.append(" ".join(line))
+            pages.append("\n".join(lines))
+        corpus.append((f"synthetic-{doc}.pdf", make_pdf(pages)))
+    return corpus, vocabulary
+
+
+class StageTimer:
+    """Times one stage and samples RSS in the background to find its peak"""
+
+    def __init__(self, name, results, unit):
+        self.name = name
+        self.results = results
+        self.unit = unit
+        self.items = 0
+
+    def _sample(self):
+        while not self._stop.wait(0.005):
+            self._peak = max(self._peak, current_rss_bytes())
+
+    def __enter__(self):
+        self._start_rss = self._peak = current_rss_bytes()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+        self._sampler.start()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self._started
+        self._stop.set()
+        self._sampler.join()
+        self._peak = max(self._peak, current_rss_bytes())
+        self.results[self.name] = {
+            "seconds": round(seconds, 4),
+            "items": self.items,
+            "unit": self.unit,
+            "per_second": round(self.items / seconds, 2) if seconds > 0 else None,
+            "peak_rss_delta_mb": round((self._peak - self._start_rss) / (1024 * 1024), 2),
+        }
+        return False
+
+
+def clear_page_cache():
+    shutil.rmtree(BENCHMARK_PAGE_CACHE_DIR, ignore_errors=True)
+
+
+def run_benchmark(num_pdfs=2, pages_per_pdf=20, chars_per_page=2000, embedder="stub", num_queries=20, seed=0,
+                  condense_mode=CONDENSE_MODE, llm_latency=0.0):
+    corpus, vocabulary = make_corpus(num_pdfs, pages_per_pdf, chars_per_page, seed)
+    if embedder == "hf":
+        embeddings = load_embeddings(HF_EMBEDDING_MODEL)
+        token_model = HF_EMBEDDING_MODEL
+    else:
+        embeddings = DedupBatchEmbeddings(StubEmbeddings(), HF_EMBED_BATCH_SIZE)
+        # The stub has no tokenizer, so chunks are sized with the estimated token count
+        token_model = None
+    rng = random.Random(seed)
+    questions = [" ".join(rng.choice(vocabulary) for _ in range(6)) + "?" for _ in range(num_queries)]
+    stages = {}
+
+    clear_page_cache()
+    with StageTimer("extract", stages, "pages") as stage:
+        files = extract_pdf_pages(corpus)
+        page_texts = [PageText(result.name, page.page_num + 1, page.text)
+                      for result in files for page in result.pages if page.text]
+        stage.items = len(page_texts)
+
+    # The same PDFs again, now served from the page text cache
+    with StageTimer("extract_cached", stages, "pages") as stage:
+        stage.items = sum(result.num_pages for result in extract_pdf_pages(corpus))
+
+    with StageTimer("split", stages, "chunks") as stage:
+        chunks = list(iter_text_chunks(page_texts, model_name=token_model))
+        texts = [chunk.page_content for chunk in chunks]
+        stage.items = len(chunks)
+
+    with StageTimer("embed", stages, "chunks") as stage:
+        vectors = embeddings.embed_documents(texts)
+        stage.items = len(chunks)
+
+    with StageTimer("index", stages, "vectors") as stage:
+        vectorstore = FAISS.from_embeddings(
+            list(zip(texts, vectors)), embeddings, metadatas=[chunk.metadata for chunk in chunks])
+        optimize_vectorstore(vectorstore)
+        stage.items = vectorstore.index.ntotal
+
+    with StageTimer("retrieve", stages, "queries") as stage:
+        for question in questions:
+            vectorstore.similarity_search(question, k=4)
+        stage.items = len(questions)
+
+    # Follow-up questions go through the condense step too, as in the app; every other one
+    # refers back to the previous turn, which the heuristic strategy rewrites
+    llm = StubLLM(responses=["This is a stub answer from the benchmark LLM."], latency=llm_latency)
+    chain = ConversationalRetrievalChain.from_llm(
+        llm=llm,
+        retriever=get_retriever(vectorstore, "hf_no_token"),
+        memory=ConversationBufferMemory(memory_key="chat_history", return_messages=True),
+    )
+    chain.question_generator = build_condense_chain(llm, condense_mode)
+    with StageTimer("answer", stages, "questions") as stage:
+        for i, question in enumerate(questions):
+            chain.invoke({"question": question if i % 2 == 0 else "How does that relate to " + question})
+        stage.items = len(questions)
+
+    # The app's path: pages stream through chunking and embedding without materializing the corpus
+    # A fresh dedup memo, so the chunks embedded above are embedded again
+    streaming_embeddings = DedupBatchEmbeddings(embeddings.embeddings, embeddings.batch_size)
+    clear_page_cache()
+    with StageTimer("ingest_streaming", stages, "pages") as stage:
+        build_vectorstore(iter_text_chunks(iter_page_texts(corpus), model_name=token_model), "hf_no_token",
+                          embeddings_loader=lambda model_name: streaming_embeddings)
+        stage.items = len(page_texts)
+
+    return {
+        "config": {
+            "pdfs": num_pdfs,
+            "pages_per_pdf": pages_per_pdf,
+            "chars_per_page": chars_per_page,
+            "embedder": embedder,
+            "engine": EMBEDDING_ENGINE if embedder == "hf" else None,
+            "pdf_extractor": get_extractor_names()[0],
+            "queries": num_queries,
+            "condense_mode": condense_mode,
+            "context_packing": CONTEXT_PACKING,
+            "llm_latency": llm_latency,
+            "seed": seed,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "stages": stages,
+        "total_seconds": round(sum(stage["seconds"] for stage in stages.values()), 4),
+        "max_rss_mb": round(current_rss_bytes() / (1024 * 1024), 2),
+    }
+
+
+def run_parity_check(engine, num_pdfs=2, pages_per_pdf=20, chars_per_page=2000, num_queries=20, seed=0):
+    """Retrieval on the synthetic corpus with an int8 engine vs the full-precision HuggingFace model"""
+    corpus, vocabulary = make_corpus(num_pdfs, pages_per_pdf, chars_per_page, seed)
+    texts = [chunk.page_content for chunk in iter_text_chunks(iter_page_texts(corpus))]
+    rng = random.Random(seed)
+    # Questions made of words from the chunks, so each one has clear nearest neighbours
+    queries = [" ".join(rng.choice(rng.choice(texts).split()) for _ in range(6)) + "?" for _ in range(num_queries)]
+    candidate = load_embeddings(HF_EMBEDDING_MODEL, engine)
+    if candidate.engine != engine:
+        raise RuntimeError(f"The {engine} embedding engine could not be loaded")
+    report = check_retrieval_parity(load_embeddings(HF_EMBEDDING_MODEL, "torch"), candidate, texts, queries)
+    report["engine"] = engine
+    report["chunks"] = len(texts)
+    return report
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """Per-stage time and memory ratios against a baseline; stages slower than 1 + tolerance regress"""
+    comparison = {}
+    for name, stage in results["stages"].items():
+        base = baseline.get("stages", {}).get(name)
+        if base is None or not base["seconds"]:
+            continue
+        ratio = stage["seconds"] / base["seconds"]
+        comparison[name] = {
+            "baseline_seconds": base["seconds"],
+            "time_ratio": round(ratio, 3),
+            "baseline_peak_rss_delta_mb": base["peak_rss_delta_mb"],
+            "regressed": ratio > 1 + tolerance,
+        }
+    if baseline.get("config") != results["config"]:
+        comparison["warning"] = "baseline was recorded with a different configuration"
+    return comparison
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the PDF pipeline offline with a synthetic corpus")
+    parser.add_argument("--pdfs", type=int, default=2, help="Synthetic PDFs to generate")
+    parser.add_argument("--pages", type=int, default=20, help="Pages per PDF")
+    parser.add_argument("--chars-per-page", type=int, default=2000, help="Approximate text per page")
+    parser.add_argument("--embedder", choices=["stub", "hf"], default="stub",
+                        help="stub: hash-based vectors; hf: the app's local HuggingFace model")
+    parser.add_argument("--queries", type=int, default=20, help="Questions for the retrieve and answer stages")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON results here instead of stdout")
+    parser.add_argument("--baseline", help="Compare against results saved with --save-baseline")
+    parser.add_argument("--save-baseline", help="Save these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed slowdown per stage before it counts as a regression (default: 0.2 = 20%%)")
+    parser.add_argument("--condense", choices=["llm", "heuristic", "off"], default=None,
+                        help="Question-condensing strategy for the answer stage (default: CONDENSE_MODE)")
+    parser.add_argument("--llm-latency", type=float, default=0.0,
+                        help="Seconds each stub LLM call takes, to see what condensing costs on a slow backend")
+    parser.add_argument("--parity", choices=INT8_ENGINES,
+                        help="Instead of timing stages, check an int8 embedding engine's retrieval against full precision")
+    args = parser.parse_args(argv)
+
+    if args.parity:
+        report = run_parity_check(args.parity, args.pdfs, args.pages, args.chars_per_page, args.queries, args.seed)
+        print(json.dumps(report, indent=2))
+        if not report["passed"]:
+            print(f"❌ {args.parity} recall@{report['k']} is {report['recall_at_k']:.0%} of full precision",
+                  file=sys.stderr)
+            return 1
+        return 0
+
+    results = run_benchmark(args.pdfs, args.pages, args.chars_per_page, args.embedder, args.queries, args.seed,
+                            args.condense or CONDENSE_MODE, args.llm_latency)
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    regressed = []
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            comparison = compare_to_baseline(results, json.load(f), args.tolerance)
+        results["comparison"] = comparison
+        regressed = [name for name, stage in comparison.items() if isinstance(stage, dict) and stage["regressed"]]
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if regressed:
+        print(f"❌ Slower than baseline: {', '.join(regressed)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
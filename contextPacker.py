@@ -0,0 +1,176 @@
+import logging
+import os
+import re
+from typing import Any, List
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from instrumentation import Span
+from localLLM import LOCAL_LLM_MODEL
+from questionCondenser import QUESTION_PREFIX
+from textChunker import get_token_counter
+
+logger = logging.getLogger(__name__)
+
+# Fit retrieved chunks to a token budget (ranked, overlap removed, trimmed to relevant sentences);
+# "false" passes the top chunks to the prompt as they are
+CONTEXT_PACKING = os.getenv("CONTEXT_PACKING", "true").lower() == "true"
+# Context tokens per question: flan-t5-small reads 512 tokens in all, prompt and question included
+HF_CONTEXT_TOKEN_BUDGET = int(os.getenv("HF_CONTEXT_TOKEN_BUDGET", "350"))
+OPENAI_CONTEXT_TOKEN_BUDGET = int(os.getenv("OPENAI_CONTEXT_TOKEN_BUDGET", "1000"))
+# Chunks retrieved as candidates for packing
+CONTEXT_CANDIDATES = int(os.getenv("CONTEXT_CANDIDATES", "6"))
+
+# Chunks the retriever returns when packing is off (LangChain's default)
+UNPACKED_CHUNKS = 4
+# Stop packing once less than this is left of the budget
+MIN_USEFUL_TOKENS = 20
+
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?;:])\s+|\s*\n+\s*")
+_WORD = re.compile(r"\w+")
+# Question words too common to say which sentences are relevant
+_STOPWORDS = frozenset("""
+    a about after all also an and any are as at be been but by can could did do does for from had has have how
+    i if in into is it its may me more most my no not of on or our should so than that the their them then there
+    these they this those to was we were what when where which who whom why will with would you your
+""".split())
+
+# The model each backend answers with, whose tokenizer sizes the prompt
+_LLM_TOKENIZERS = {"openai": "gpt-3.5-turbo", "local": LOCAL_LLM_MODEL}
+_HF_LLM_MODEL = "google/flan-t5-small"
+
+
+def get_context_budget(processing_mode):
+    return OPENAI_CONTEXT_TOKEN_BUDGET if processing_mode == "openai" else HF_CONTEXT_TOKEN_BUDGET
+
+
+def get_llm_token_counter(processing_mode):
+    """Token counter for the prompts of a backend's answering model"""
+    return get_token_counter(_LLM_TOKENIZERS.get(processing_mode, _HF_LLM_MODEL))
+
+
+def split_sentences(text):
+    return [sentence for sentence in _SENTENCE_SPLIT.split(text) if sentence.strip()]
+
+
+def _query_terms(question):
+    if question.startswith(QUESTION_PREFIX):
+        question = question[len(QUESTION_PREFIX):]
+    return {word for word in _WORD.findall(question.lower()) if word not in _STOPWORDS}
+
+
+def _normalize(text):
+    return " ".join(_WORD.findall(text.lower()))
+
+
+def _is_cut_tail(normalized, seen):
+    # A chunk that starts inside a sentence (the overlap with its predecessor) repeats the sentence's end
+    return any(sentence.endswith(" " + normalized) for sentence in seen)
+
+
+def _truncate(sentence, tokens, budget):
+    """The start of a sentence, cut to roughly budget of its tokens"""
+    words = sentence.split()
+    return " ".join(words[:max(1, len(words) * max(budget, 0) // max(tokens, 1))])
+
+
+def pack_context(question, chunks, token_counter, budget):
+    """Fit chunks (best first) into budget tokens.
+
+    Sentences already packed from a higher-ranked chunk, such as the overlap between
+    neighbouring chunks, are dropped. A chunk that no longer fits whole is cut down to its
+    sentences that share words with the question, most matching first, kept in text order.
+    The top chunk is always kept, truncated if even its best sentence is over the budget.
+    Returns the packed Documents and the token counts before and after packing.
+    """
+    terms = _query_terms(question)
+    chunk_sentences = [split_sentences(chunk.page_content) for chunk in chunks]
+    # When no chunk shares a word with the question (a paraphrase), trimming keeps the best chunk's opening
+    lexical_match = any(terms & set(_WORD.findall(chunk.page_content.lower())) for chunk in chunks)
+    packed = []
+    seen = set()
+    remaining = budget
+    input_tokens = 0
+    for rank, (chunk, sentences) in enumerate(zip(chunks, chunk_sentences)):
+        counts = token_counter.count(sentences) if sentences else []
+        input_tokens += sum(counts)
+        if packed and remaining < MIN_USEFUL_TOKENS:
+            continue
+
+        candidates = []
+        chunk_seen = set()
+        for i, (sentence, tokens) in enumerate(zip(sentences, counts)):
+            normalized = _normalize(sentence)
+            if normalized in seen or normalized in chunk_seen or (i == 0 and _is_cut_tail(normalized, seen)):
+                continue
+            candidates.append((i, sentence, tokens))
+            chunk_seen.add(normalized)
+        if not candidates:
+            continue
+
+        scores = {i: len(terms & set(_WORD.findall(sentence.lower()))) for i, sentence, _ in candidates}
+        if sum(tokens for _, _, tokens in candidates) <= remaining:
+            kept = candidates
+        else:
+            relevant = [candidate for candidate in candidates if scores[candidate[0]] > 0]
+            if rank == 0 and not lexical_match:
+                relevant = candidates
+            kept = []
+            left = remaining
+            for candidate in sorted(relevant, key=lambda candidate: -scores[candidate[0]]):
+                if candidate[2] <= left:
+                    kept.append(candidate)
+                    left -= candidate[2]
+            kept.sort()
+        truncated = not kept and not packed
+        if truncated:
+            # Nothing fits whole, but an empty context is worse than the start of the best sentence
+            i, sentence, tokens = max(candidates, key=lambda candidate: scores[candidate[0]])
+            seen.add(_normalize(sentence))
+            sentence = _truncate(sentence, tokens, remaining)
+            kept = [(i, sentence, token_counter.count([sentence])[0])]
+        if not kept:
+            continue
+
+        text = " ".join(sentence for _, sentence, _ in kept)
+        remaining -= sum(tokens for _, _, tokens in kept)
+        if not truncated:
+            seen.update(_normalize(sentence) for _, sentence, _ in kept)
+        metadata = dict(chunk.metadata)
+        if truncated or len(kept) < len(sentences):
+            metadata["trimmed"] = True
+        packed.append(Document(page_content=text, metadata=metadata))
+    return packed, input_tokens, budget - remaining
+
+
+class PackedContextRetriever(BaseRetriever):
+    """Retrieves CONTEXT_CANDIDATES chunks and packs them into the backend's context budget"""
+
+    vectorstore: Any
+    token_counter: Any
+    token_budget: int
+    candidates: int = CONTEXT_CANDIDATES
+    backend: str = ""
+
+    def _get_relevant_documents(self, query: str, *,
+                                run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        chunks = self.vectorstore.similarity_search(query, k=self.candidates)
+        with Span("context_packing", backend=self.backend) as span:
+            packed, input_tokens, context_tokens = pack_context(query, chunks, self.token_counter, self.token_budget)
+            span.add(candidates=len(chunks), chunks=len(packed), input_tokens=input_tokens,
+                     context_tokens=context_tokens)
+        return packed
+
+
+def get_retriever(vectorstore, processing_mode):
+    """The retriever a backend's chain uses: packed to its token budget unless CONTEXT_PACKING is off"""
+    if not CONTEXT_PACKING:
+        return vectorstore.as_retriever(search_kwargs={"k": UNPACKED_CHUNKS})
+    return PackedContextRetriever(
+        vectorstore=vectorstore,
+        token_counter=get_llm_token_counter(processing_mode),
+        token_budget=get_context_budget(processing_mode),
+        backend=processing_mode,
+    )
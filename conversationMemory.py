@@ -0,0 +1,54 @@
+import logging
+from typing import Any
+
+from langchain.memory import ConversationSummaryBufferMemory
+from langchain_core.messages import get_buffer_string
+
+from instrumentation import Span
+from requestExecution import retry_with_backoff
+from requestScheduler import SCHEDULER
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBudgetMemory(ConversationSummaryBufferMemory):
+    """Recent turns within a token budget plus a rolling summary of older ones.
+
+    Turns are measured with the backend's own tokenizer; the stock class counts with GPT-2's,
+    which has to be downloaded and undercounts flan-t5. The summary is asked for through the
+    backend's scheduler with backoff retries, and if that still fails the older turns are
+    dropped without a summary rather than failing the turn.
+    """
+
+    token_counter: Any
+    backend: str = ""
+    max_retries: int = 3
+    base_delay: float = 1.0
+    max_delay: float = 10.0
+
+    def _buffer_tokens(self, messages):
+        if not messages:
+            return 0
+        return self.token_counter.count_uncached([get_buffer_string(messages)])[0]
+
+    def prune(self) -> None:
+        buffer = self.chat_memory.messages
+        pruned = []
+        while buffer and self._buffer_tokens(buffer) > self.max_token_limit:
+            pruned.append(buffer.pop(0))
+        if not pruned:
+            return
+
+        with Span("memory_summary", backend=self.backend) as span:
+            span.add(messages=len(pruned))
+            try:
+                self.moving_summary_buffer = retry_with_backoff(
+                    lambda: SCHEDULER.run(
+                        self.backend, lambda: self.predict_new_summary(pruned, self.moving_summary_buffer)),
+                    max_retries=self.max_retries,
+                    base_delay=self.base_delay,
+                    max_delay=self.max_delay,
+                )
+            except Exception as e:
+                logger.warning("Could not summarize %d older messages, dropping them: %s", len(pruned), e)
+                span.add(failed=1)
@@ -0,0 +1,93 @@
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from requestScheduler import SCHEDULER
+
+logger = logging.getLogger(__name__)
+
+# Vectors remembered across calls per embeddings client (1024 MiniLM vectors take 1.5 MB, ada-002 ones 6 MB)
+EMBED_MEMO_SIZE = int(os.getenv("EMBED_MEMO_SIZE", "1024"))
+
+
+class DedupBatchEmbeddings(Embeddings):
+    """Embeddings wrapper that embeds each distinct text once, in fixed-size batches.
+
+    Texts are hashed, only unseen ones are sent to the wrapped model (batch_size at a time)
+    and the vectors are fanned back out to every duplicate. A bounded LRU memo of float32
+    arrays also skips texts embedded by earlier calls, such as boilerplate repeated across
+    batches and PDFs.
+    With a scheduler backend name, model calls are rate limited and identical concurrent
+    calls (the same question from several sessions, say) share one result.
+    """
+
+    def __init__(self, embeddings, batch_size, memo_size=EMBED_MEMO_SIZE, backend=None):
+        self.embeddings = embeddings
+        self.batch_size = max(1, batch_size)
+        self.memo_size = memo_size
+        self.backend = backend
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
+        self.texts_seen = 0
+        self.texts_embedded = 0
+
+    @property
+    def model_name(self):
+        # Used as the index cache key, so report the wrapped model's name
+        return getattr(self.embeddings, "model_name", None) or getattr(self.embeddings, "model", None)
+
+    @property
+    def engine(self):
+        # Non-default inference engine of the wrapped model, if any (also part of the cache key)
+        return getattr(self.embeddings, "engine", None)
+
+    @staticmethod
+    def _key(text):
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def embed_documents(self, texts):
+        keys = [self._key(text) for text in texts]
+        vectors = {}
+        missing = {}
+        with self._lock:
+            for key, text in zip(keys, texts):
+                if key in vectors or key in missing:
+                    continue
+                if key in self._memo:
+                    self._memo.move_to_end(key)
+                    vectors[key] = self._memo[key]
+                else:
+                    missing[key] = text
+
+        missing_keys = list(missing)
+        for start in range(0, len(missing_keys), self.batch_size):
+            batch_keys = missing_keys[start:start + self.batch_size]
+            batch_texts = [missing[key] for key in batch_keys]
+            batch_vectors = self._call(self.embeddings.embed_documents, batch_texts,
+                                       self._key("\0".join(batch_keys)))
+            vectors.update((key, np.asarray(vector, dtype=np.float32)) for key, vector in zip(batch_keys, batch_vectors))
+
+        with self._lock:
+            for key in missing_keys:
+                self._memo[key] = vectors[key]
+            while len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+            self.texts_seen += len(texts)
+            self.texts_embedded += len(missing_keys)
+
+        if len(missing_keys) < len(texts):
+            logger.debug("Embedded %d of %d texts, the rest were duplicates", len(missing_keys), len(texts))
+        return [vectors[key].tolist() for key in keys]
+
+    def embed_query(self, text):
+        return self._call(self.embeddings.embed_query, text, "query:" + self._key(text))
+
+    def _call(self, method, texts, key):
+        if self.backend is None:
+            return method(texts)
+        return SCHEDULER.run(self.backend, lambda: method(texts), key=key)
@@ -0,0 +1,111 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+from langchain_community.vectorstores import FAISS
+
+logger = logging.getLogger(__name__)
+
+# Where cached FAISS indexes live and how much disk they may use in total
+INDEX_CACHE_DIR = os.getenv("INDEX_CACHE_DIR", ".index_cache")
+INDEX_CACHE_MAX_MB = float(os.getenv("INDEX_CACHE_MAX_MB", "1024"))
+
+# Bump when the on-disk layout changes so stale entries are never loaded
+CACHE_FORMAT_VERSION = 2
+
+
+def get_cache_key(pdf_bytes, chunk_size, chunk_overlap, model_name):
+    """Content-addressed key for one PDF's index: file bytes + chunking + embedding model"""
+    digest = hashlib.sha256(pdf_bytes)
+    digest.update(json.dumps({
+        "version": CACHE_FORMAT_VERSION,
+        "chunk_size": chunk_size,
+        "chunk_overlap": chunk_overlap,
+        "model_name": model_name,
+    }, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def load_index(cache_key, embeddings):
+    """Load a cached FAISS index and docstore, or return None on a cache miss"""
+    path = os.path.join(INDEX_CACHE_DIR, cache_key)
+    if not os.path.isdir(path):
+        return None
+
+    try:
+        # Only files written by save_index() end up here, so unpickling the docstore is safe
+        vectorstore = FAISS.load_local(path, embeddings, allow_dangerous_deserialization=True)
+    except Exception as e:
+        logger.warning("Discarding unreadable index cache entry %s: %s", cache_key, e)
+        shutil.rmtree(path, ignore_errors=True)
+        return None
+
+    # Touch the entry so LRU eviction sees it as recently used
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return vectorstore
+
+
+def save_index(cache_key, vectorstore):
+    """Persist a FAISS index under its cache key, then enforce the size cap"""
+    os.makedirs(INDEX_CACHE_DIR, exist_ok=True)
+    path = os.path.join(INDEX_CACHE_DIR, cache_key)
+
+    # Write into a temporary directory and rename it so readers never see a partial entry
+    tmp_path = tempfile.mkdtemp(prefix=".tmp-", dir=INDEX_CACHE_DIR)
+    try:
+        vectorstore.save_local(tmp_path)
+        if os.path.isdir(path):
+            # Another session cached the same document first
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        else:
+            os.replace(tmp_path, path)
+    except Exception as e:
+        logger.warning("Could not cache index %s: %s", cache_key, e)
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        return
+
+    evict_lru(keep=cache_key)
+
+
+def _entry_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def evict_lru(keep=None):
+    """Delete least recently used entries until the cache fits in INDEX_CACHE_MAX_MB"""
+    if not os.path.isdir(INDEX_CACHE_DIR):
+        return
+
+    entries = []
+    for name in os.listdir(INDEX_CACHE_DIR):
+        path = os.path.join(INDEX_CACHE_DIR, name)
+        if name.startswith(".") or not os.path.isdir(path):
+            continue
+        try:
+            entries.append((os.path.getmtime(path), name, _entry_size(path)))
+        except OSError:
+            continue
+
+    max_bytes = INDEX_CACHE_MAX_MB * 1024 * 1024
+    total = sum(size for _, _, size in entries)
+    for _, name, size in sorted(entries):
+        if total <= max_bytes:
+            break
+        if name == keep:
+            continue
+        shutil.rmtree(os.path.join(INDEX_CACHE_DIR, name), ignore_errors=True)
+        total -= size
+        logger.info("Evicted index cache entry %s (%d bytes)", name, size)
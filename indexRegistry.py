@@ -0,0 +1,148 @@
+import hashlib
+import logging
+import threading
+import weakref
+from collections import OrderedDict
+
+import faiss
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+
+from mappedStore import MappedDocstore
+
+logger = logging.getLogger(__name__)
+
+
+def get_library_key(doc_ids, model_name):
+    """Registry key for a set of documents embedded with one model"""
+    digest = hashlib.sha256(model_name.encode("utf-8"))
+    for doc_id in sorted(doc_ids):
+        digest.update(b"\0" + doc_id.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def estimate_vectorstore_bytes(vectorstore):
+    """Approximate resident size of a FAISS store: vectors, graph links or codes, and chunk texts"""
+    index = vectorstore.index
+    links = index.hnsw.nb_neighbors(0) * 4 if isinstance(index, faiss.IndexHNSW) else 0
+    # IVF inverted lists (codes plus 8-byte ids) are read into private memory even from a mapped store
+    lists = index.invlists.code_size + 8 if isinstance(index, faiss.IndexIVF) else 0
+    if isinstance(vectorstore.docstore, MappedDocstore):
+        # Memory-mapped codes and texts live in the page cache, shared with other processes
+        return index.ntotal * (links + lists)
+    if isinstance(index, faiss.IndexHNSW):
+        per_vector = faiss.downcast_index(index.storage).code_size + links
+    elif isinstance(index, faiss.IndexIVF):
+        per_vector = lists
+    else:
+        per_vector = faiss.downcast_index(index).code_size
+    text_bytes = sum(len(doc.page_content) for doc in vectorstore.docstore._dict.values())
+    return index.ntotal * per_vector + text_bytes
+
+
+def copy_vectorstore(vectorstore):
+    """Private copy of a shared store, for a session that needs to add or remove documents"""
+    docstore = vectorstore.docstore
+    if isinstance(docstore, MappedDocstore):
+        # clone_index() would keep pointing at the read-only mapped codes; a serialized copy owns them
+        index = faiss.deserialize_index(faiss.serialize_index(vectorstore.index))
+        chunks = docstore.to_dict()
+    else:
+        index = faiss.clone_index(vectorstore.index)
+        chunks = dict(docstore._dict)
+    return FAISS(
+        embedding_function=vectorstore.embedding_function,
+        index=index,
+        docstore=InMemoryDocstore(chunks),
+        index_to_docstore_id=dict(vectorstore.index_to_docstore_id),
+        normalize_L2=vectorstore._normalize_L2,
+        distance_strategy=vectorstore.distance_strategy,
+    )
+
+
+class IndexHandle:
+    """A session's reference to a shared vector store; treat vectorstore and documents as read-only"""
+
+    def __init__(self, registry, key, entry):
+        self.key = key
+        self.vectorstore = entry["vectorstore"]
+        self.documents = entry["documents"]
+        self.model_name = entry["model_name"]
+        # Sessions that end without releasing their handle still drop the reference when collected
+        self._finalizer = weakref.finalize(self, registry.release, key)
+
+    def release(self):
+        self._finalizer()
+
+
+class IndexRegistry:
+    """Process-wide, reference-counted vector stores shared by every session that opens the same library.
+
+    Stores nobody holds a handle to stay loaded for reuse until the registry exceeds max_bytes,
+    then the least recently used of them are dropped.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    def acquire(self, key):
+        """Handle to an already loaded library, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            entry["refs"] += 1
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return IndexHandle(self, key, entry)
+
+    def register(self, key, vectorstore, documents, model_name):
+        """Share a newly built library; if another session registered it first, theirs is returned"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = {
+                    "vectorstore": vectorstore,
+                    "documents": documents,
+                    "model_name": model_name,
+                    "bytes": estimate_vectorstore_bytes(vectorstore),
+                    "refs": 0,
+                }
+                self._entries[key] = entry
+            entry["refs"] += 1
+            self._entries.move_to_end(key)
+            self._evict()
+            return IndexHandle(self, key, entry)
+
+    def release(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry["refs"] = max(0, entry["refs"] - 1)
+            self._evict()
+
+    def _evict(self):
+        total = sum(entry["bytes"] for entry in self._entries.values())
+        for key, entry in list(self._entries.items()):
+            if total <= self.max_bytes:
+                break
+            if entry["refs"] > 0:
+                continue
+            del self._entries[key]
+            total -= entry["bytes"]
+            logger.info("Evicted shared index %s (%d bytes)", key, entry["bytes"])
+
+    def stats(self):
+        with self._lock:
+            return {
+                "indexes": len(self._entries),
+                "in_use": sum(1 for entry in self._entries.values() if entry["refs"] > 0),
+                "bytes": sum(entry["bytes"] for entry in self._entries.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
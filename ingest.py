@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Build vector indexes for a folder of PDFs without the Streamlit app.
+
+Every PDF is written to the index cache the app reads (INDEX_CACHE_DIR), so uploading
+it later skips embedding; --output also saves the whole folder as one library index.
+
+    python ingest.py ./pdfs --output ./library --mode hf_no_token --workers 4
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from dotenv import load_dotenv
+
+# Load environment variables before the pipeline reads its settings
+load_dotenv()
+
+from ingestionPipeline import ConsoleReporter, ProgressReporter, build_library, save_library
+from mappedStore import STORAGE_DTYPES, VECTOR_STORAGE_DTYPE
+
+
+def find_pdfs(folder, recursive=False):
+    paths = []
+    for root, dirs, files in os.walk(folder):
+        paths.extend(os.path.join(root, name) for name in files if name.lower().endswith(".pdf"))
+        if not recursive:
+            break
+    return sorted(paths)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pre-build vector indexes for a folder of PDFs")
+    parser.add_argument("folder", help="Folder containing the PDFs")
+    parser.add_argument("--output", help="Also save all PDFs as one library index in this folder")
+    parser.add_argument("--mode", default="hf_no_token", choices=["hf_no_token", "hf_with_token", "openai"],
+                        help="Processing mode, which decides the embedding model (default: hf_no_token)")
+    parser.add_argument("--dtype", default=VECTOR_STORAGE_DTYPE, choices=STORAGE_DTYPES,
+                        help=f"How --output stores vectors: float16 halves and int8 quarters the size "
+                             f"(default: {VECTOR_STORAGE_DTYPE})")
+    parser.add_argument("--workers", type=int, default=None, help="PDFs embedded at the same time")
+    parser.add_argument("--recursive", action="store_true", help="Include PDFs in subfolders")
+    parser.add_argument("--quiet", action="store_true", help="Only print the summary")
+    args = parser.parse_args(argv)
+
+    paths = find_pdfs(args.folder, args.recursive)
+    if not paths:
+        print(f"❌ No PDF files found in {args.folder}", file=sys.stderr)
+        return 1
+
+    reporter = ProgressReporter() if args.quiet else ConsoleReporter()
+    pdf_files = []
+    for path in paths:
+        with open(path, "rb") as f:
+            pdf_files.append((os.path.relpath(path, args.folder), f.read()))
+
+    started = time.perf_counter()
+    vectorstore, documents = build_library(pdf_files, args.mode, reporter, workers=args.workers)
+    elapsed = time.perf_counter() - started
+    if vectorstore is None:
+        print("❌ No PDF could be indexed", file=sys.stderr)
+        return 1
+
+    if args.output:
+        save_library(vectorstore, documents, args.output, args.dtype)
+    print(f"✅ Indexed {len(documents)} of {len(paths)} PDFs ({vectorstore.index.ntotal} chunks) in {elapsed:.1f}s"
+          + (f" - library saved to {args.output}" if args.output else ""))
+    return 0 if len(documents) == len(paths) else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
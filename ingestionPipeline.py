@@ -0,0 +1,466 @@
+import functools
+import hashlib
+import itertools
+import json
+import logging
+import os
+import sys
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_community.vectorstores import FAISS
+
+from embeddingBatcher import DedupBatchEmbeddings
+from indexCache import get_cache_key, load_index, save_index
+from instrumentation import Span, new_trace_id
+from mappedStore import VECTOR_STORAGE_DTYPE, is_mapped_store, load_mapped_store, save_mapped_store
+from pdfExtraction import iter_pdf_pages
+from quantizedEmbeddings import EMBEDDING_ENGINE, INT8_ENGINES, QuantizedEmbeddings
+from textChunker import CHUNK_OVERLAP_TOKENS, CHUNK_TOKENS, PageText, get_token_counter, iter_token_chunks
+from vectorIndex import optimize_vectorstore
+
+logger = logging.getLogger(__name__)
+
+# Embedding models (part of the index cache key, with the chunk sizes in textChunker)
+HF_EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+OPENAI_EMBEDDING_MODEL = "text-embedding-ada-002"
+# Documents ingested concurrently by build_library(); page extraction has its own process pool
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+# Unique chunks sent per embedding call: local model throughput vs OpenAI per-request input limits
+HF_EMBED_BATCH_SIZE = int(os.getenv("HF_EMBED_BATCH_SIZE", "64"))
+OPENAI_EMBED_BATCH_SIZE = int(os.getenv("OPENAI_EMBED_BATCH_SIZE", "256"))
+
+
+class ProgressReporter:
+    """Receives ingestion messages and per-file page progress; this base class stays silent"""
+
+    def info(self, message):
+        pass
+
+    def success(self, message):
+        pass
+
+    def warning(self, message):
+        pass
+
+    def error(self, message):
+        pass
+
+    def start_file(self, name, num_pages):
+        pass
+
+    def page_done(self, name, page_num, num_pages):
+        pass
+
+    def end_file(self, name):
+        pass
+
+
+class ConsoleReporter(ProgressReporter):
+    """Prints messages and roughly every 10% of each file's pages to stderr"""
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stderr
+        self._lock = threading.Lock()
+
+    def _print(self, message):
+        with self._lock:
+            print(message, file=self.stream, flush=True)
+
+    def info(self, message):
+        self._print(message)
+
+    def success(self, message):
+        self._print(message)
+
+    def warning(self, message):
+        self._print(f"WARNING: {message}")
+
+    def error(self, message):
+        self._print(f"ERROR: {message}")
+
+    def page_done(self, name, page_num, num_pages):
+        step = max(1, num_pages // 10)
+        if (page_num + 1) % step == 0 or page_num + 1 == num_pages:
+            self._print(f"{name}: page {page_num + 1}/{num_pages}")
+
+
+def has_openai_key():
+    key = os.getenv("OPENAI_API_KEY")
+    return bool(key) and key != "your_openai_api_key_here"
+
+
+def get_embedding_model_name(processing_mode="hf_no_token"):
+    """Name of the embedding model a processing mode will use"""
+    if processing_mode == "openai" and has_openai_key():
+        return OPENAI_EMBEDDING_MODEL
+    return HF_EMBEDDING_MODEL
+
+
+def load_embeddings(model_name, engine=EMBEDDING_ENGINE):
+    """Deduplicating, batched embeddings client for one of the supported models"""
+    # Provider classes are imported here so only the model in use is loaded
+    if model_name == OPENAI_EMBEDDING_MODEL:
+        from langchain_community.embeddings import OpenAIEmbeddings
+
+        embeddings = OpenAIEmbeddings(model=OPENAI_EMBEDDING_MODEL, chunk_size=OPENAI_EMBED_BATCH_SIZE)
+        return DedupBatchEmbeddings(embeddings, OPENAI_EMBED_BATCH_SIZE, backend="openai_embeddings")
+
+    if engine in INT8_ENGINES:
+        try:
+            embeddings = QuantizedEmbeddings(HF_EMBEDDING_MODEL, engine, batch_size=HF_EMBED_BATCH_SIZE)
+            return DedupBatchEmbeddings(embeddings, HF_EMBED_BATCH_SIZE, backend="hf_embeddings")
+        except Exception as e:
+            logger.warning("Could not load the %s embedding engine, using full precision: %s", engine, e)
+
+    from langchain_community.embeddings import HuggingFaceInstructEmbeddings
+
+    embeddings = HuggingFaceInstructEmbeddings(
+        model_name=HF_EMBEDDING_MODEL,
+        encode_kwargs={"batch_size": HF_EMBED_BATCH_SIZE}
+    )
+    return DedupBatchEmbeddings(embeddings, HF_EMBED_BATCH_SIZE, backend="hf_embeddings")
+
+
+# One client per model for the whole process when no other loader is passed in
+get_embeddings = functools.lru_cache(maxsize=None)(load_embeddings)
+
+
+def get_vectorstore_model_name(vectorstore):
+    embeddings = vectorstore.embeddings
+    return getattr(embeddings, "model_name", None) or getattr(embeddings, "model", None)
+
+
+def get_embedding_key(model_name, embeddings):
+    """Index cache identity of an embedding model: its name, plus the engine when it is not the default"""
+    engine = getattr(embeddings, "engine", None)
+    return f"{model_name}@{engine}" if engine else model_name
+
+
+def _iter_file_texts(result, reporter):
+    """Stream PageTexts out of one extracted file, reporting progress as pages are pulled"""
+    if result.error:
+        reporter.error(f"Error reading PDF {result.name}: {result.error}")
+        return
+
+    source = "cached text" if result.extractor == "cache" else result.extractor
+    reporter.info(f"Processing PDF: {result.name} ({result.num_pages} pages, {source})")
+    reporter.start_file(result.name, result.num_pages)
+    for page in result.pages:
+        if page.error:
+            reporter.warning(f"Error reading page {page.page_num + 1} of {result.name}: {page.error}")
+        elif page.text.strip():
+            # Downstream chunking and embedding run before the next page is pulled
+            yield PageText(result.name, page.page_num + 1, page.text)
+        else:
+            reporter.warning(f"No text found on page {page.page_num + 1} of {result.name}")
+        reporter.page_done(result.name, page.page_num, result.num_pages)
+    reporter.end_file(result.name)
+
+
+def _report_total_text(pages, reporter):
+    total_chars = 0
+    for page in pages:
+        total_chars += len(page.text)
+        yield page
+
+    if total_chars == 0:
+        reporter.error("No readable text found in any of the uploaded PDF files.")
+    else:
+        reporter.success(f"Extracted {total_chars} characters from PDF files.")
+
+
+def iter_page_texts(pdf_files, reporter=None):
+    """Stream PageTexts out of (name, bytes) PDFs, reporting progress as pages are pulled"""
+    reporter = reporter or ProgressReporter()
+    pages = itertools.chain.from_iterable(_iter_file_texts(result, reporter) for result in iter_pdf_pages(pdf_files))
+    return _report_total_text(pages, reporter)
+
+
+def iter_text_chunks(pages, reporter=None, model_name=HF_EMBEDDING_MODEL):
+    """Split a stream of PageTexts into Documents sized in the embedding model's tokens, tagged with file and page"""
+    reporter = reporter or ProgressReporter()
+    chunk_count = 0
+    for chunk in iter_token_chunks(pages, get_token_counter(model_name), CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS):
+        chunk_count += 1
+        yield chunk
+
+    if chunk_count == 0:
+        reporter.error("No text chunks created. The PDF might be empty or unreadable.")
+    else:
+        reporter.info(f"Created {chunk_count} text chunks for processing.")
+
+
+def _batched(items, batch_size):
+    iterator = iter(items)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def _add_to_vectorstore(vectorstore, embeddings, documents, embedding_span, index_span):
+    """Embed one batch of chunk Documents and add it to the index, creating the index on the first batch"""
+    texts = [document.page_content for document in documents]
+    metadatas = [document.metadata for document in documents]
+    with embedding_span.measure():
+        text_embeddings = list(zip(texts, embeddings.embed_documents(texts)))
+    embedding_span.add(chunks=len(texts))
+    with index_span.measure():
+        if vectorstore is None:
+            return FAISS.from_embeddings(text_embeddings, embeddings, metadatas=metadatas)
+        vectorstore.add_embeddings(text_embeddings, metadatas=metadatas)
+        return vectorstore
+
+
+def build_vectorstore(text_chunks, processing_mode="hf_no_token", reporter=None, embeddings_loader=None, trace=None):
+    """Embed a stream of chunks in fixed-size batches, adding each batch to the index as it arrives"""
+    reporter = reporter or ProgressReporter()
+    embeddings_loader = embeddings_loader or get_embeddings
+    embedding_span = Span("embedding", trace=trace or new_trace_id())
+    index_span = Span("index_build", trace=embedding_span.attributes["trace"])
+    try:
+        embeddings = None
+        # Determine which embeddings to use based on user choice
+        if processing_mode == "openai":
+            if has_openai_key():
+                embeddings = embeddings_loader(OPENAI_EMBEDDING_MODEL)
+                reporter.info("🚀 Using OpenAI embeddings (user selected) - streaming text chunks into the vector store...")
+            else:
+                reporter.error("❌ No valid OpenAI API key found! Please add it to your .env file or choose a different processing mode.")
+                reporter.info("💡 Switching to HuggingFace embeddings...")
+
+        if embeddings is None:
+            # Use HuggingFace embeddings (free) - works with or without token
+            reporter.info("🤗 Using free HuggingFace embeddings (cached - faster after first run)...")
+            embeddings = embeddings_loader(HF_EMBEDDING_MODEL)
+
+        vectorstore = None
+        for batch in _batched(text_chunks, embeddings.batch_size):
+            try:
+                vectorstore = _add_to_vectorstore(vectorstore, embeddings, batch, embedding_span, index_span)
+            except Exception as openai_error:
+                if embeddings.model_name != OPENAI_EMBEDDING_MODEL:
+                    raise
+                if "quota" in str(openai_error).lower() or "429" in str(openai_error):
+                    reporter.error("❌ OpenAI quota exceeded! Falling back to HuggingFace embeddings...")
+                else:
+                    reporter.error(f"❌ OpenAI error: {str(openai_error)}. Falling back to HuggingFace embeddings...")
+                embeddings = embeddings_loader(HF_EMBEDDING_MODEL)
+
+                # Re-embed whatever OpenAI already indexed, then continue the stream
+                indexed_documents = []
+                if vectorstore is not None:
+                    indexed_documents = [vectorstore.docstore.search(vectorstore.index_to_docstore_id[i])
+                                         for i in range(vectorstore.index.ntotal)]
+                vectorstore = None
+                for redo_batch in _batched(indexed_documents + batch, embeddings.batch_size):
+                    vectorstore = _add_to_vectorstore(vectorstore, embeddings, redo_batch, embedding_span, index_span)
+
+        embedding_span.attributes["model"] = embeddings.model_name
+        if getattr(embeddings, "engine", None):
+            embedding_span.attributes["engine"] = embeddings.engine
+        embedding_span.finish()
+        index_span.add(vectors=vectorstore.index.ntotal if vectorstore is not None else 0)
+        index_span.finish()
+        if vectorstore is None:
+            reporter.error("No text chunks available to create vector store.")
+            return None
+
+        if embeddings.model_name == OPENAI_EMBEDDING_MODEL:
+            reporter.success("✅ Vector store created successfully with OpenAI embeddings!")
+        else:
+            reporter.success("✅ Vector store created successfully with HuggingFace embeddings!")
+        return vectorstore
+
+    except Exception as e:
+        embedding_span.finish(error=repr(e))
+        index_span.finish(error=repr(e))
+        reporter.error(f"❌ Error creating vector store: {str(e)}")
+        return None
+
+
+def _load_cached_document(name, pdf_bytes, model_name, reporter, embeddings_loader, trace):
+    try:
+        with Span("index_cache_load", document=name, trace=trace):
+            embeddings = embeddings_loader(model_name)
+            # Vectors from the int8 engines are close to, but not the same as, full-precision ones
+            cache_key = get_cache_key(pdf_bytes, CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS,
+                                      get_embedding_key(model_name, embeddings))
+            return load_index(cache_key, embeddings)
+    except Exception as e:
+        reporter.warning(f"⚠️ Could not read index cache for {name}: {str(e)}")
+        return None
+
+
+def _build_extracted_document(result, pdf_bytes, processing_mode, reporter, embeddings_loader, trace):
+    """Chunk and embed one extracted file into its own vector store and save it to the index cache"""
+    name = result.name
+    model_name = get_embedding_model_name(processing_mode)
+    # Pages flow through chunking and embedding without materializing the whole document,
+    # so each span only counts the time spent in its own stage
+    extraction_span = Span("extraction", document=name, trace=trace)
+    chunking_span = Span("chunking", document=name, trace=trace)
+    pages = extraction_span.iterate(_report_total_text(_iter_file_texts(result, reporter), reporter), count="pages")
+    text_chunks = chunking_span.iterate(iter_text_chunks(pages, reporter, model_name), count="chunks")
+    vectorstore = build_vectorstore(text_chunks, processing_mode, reporter, embeddings_loader, trace)
+    extraction_span.finish()
+    chunking_span.finish()
+    if vectorstore is None:
+        return None
+
+    # Key the entry by the model actually used, since OpenAI may have fallen back to HuggingFace
+    used_model = get_vectorstore_model_name(vectorstore) or model_name
+    cache_key = get_cache_key(pdf_bytes, CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS,
+                              get_embedding_key(used_model, vectorstore.embeddings))
+    save_index(cache_key, vectorstore)
+    return vectorstore
+
+
+def iter_document_vectorstores(pdf_files, processing_mode="hf_no_token", reporter=None, embeddings_loader=None):
+    """Yield (name, vector store or None) for each (name, bytes) PDF, in order, reusing the on-disk index cache.
+
+    The PDFs that need embedding share one extraction stream, so the process pool extracts
+    the next files' pages while one file is being chunked and embedded.
+    """
+    reporter = reporter or ProgressReporter()
+    embeddings_loader = embeddings_loader or get_embeddings
+    model_name = get_embedding_model_name(processing_mode)
+
+    # (name, bytes, trace, cached store) in upload order, filled as extraction looks ahead
+    checked = deque()
+
+    def uncached_files():
+        for name, pdf_bytes in pdf_files:
+            trace = new_trace_id()
+            vectorstore = _load_cached_document(name, pdf_bytes, model_name, reporter, embeddings_loader, trace)
+            checked.append((name, pdf_bytes, trace, vectorstore))
+            if vectorstore is None:
+                yield name, pdf_bytes
+
+    def cached_documents():
+        while checked and checked[0][3] is not None:
+            name, _, _, vectorstore = checked.popleft()
+            reporter.info(f"⚡ Loaded cached index for {name} - skipping re-embedding")
+            yield name, vectorstore
+
+    for result in iter_pdf_pages(uncached_files()):
+        yield from cached_documents()
+        _, pdf_bytes, trace, _ = checked.popleft()
+        yield result.name, _build_extracted_document(
+            result, pdf_bytes, processing_mode, reporter, embeddings_loader, trace)
+    yield from cached_documents()
+
+
+def build_document_vectorstore(name, pdf_bytes, processing_mode="hf_no_token", reporter=None, embeddings_loader=None):
+    """Build the vector store for one PDF, reusing the on-disk index cache when possible"""
+    _, vectorstore = next(iter_document_vectorstores([(name, pdf_bytes)], processing_mode, reporter, embeddings_loader))
+    return vectorstore
+
+
+def get_document_id(pdf_bytes):
+    return hashlib.sha256(pdf_bytes).hexdigest()
+
+
+def add_document_vectors(vectorstore, doc_vectorstore, doc_id, name):
+    """Copy one document's vectors into a library store, tagged with its source ID so it can be removed later.
+
+    Returns the library store (created on the first document) and the document's chunk IDs.
+    """
+    count = doc_vectorstore.index.ntotal
+    vectors = doc_vectorstore.index.reconstruct_n(0, count)
+    chunks = [doc_vectorstore.docstore.search(doc_vectorstore.index_to_docstore_id[i]) for i in range(count)]
+    texts = [chunk.page_content for chunk in chunks]
+    chunk_ids = [f"{doc_id}-{i}" for i in range(count)]
+    # Keep each chunk's page numbers; the library names the file as it was uploaded
+    metadatas = [{**chunk.metadata, "source": name, "doc_id": doc_id} for chunk in chunks]
+    if vectorstore is None:
+        vectorstore = FAISS.from_embeddings(
+            list(zip(texts, vectors)), doc_vectorstore.embeddings, metadatas=metadatas, ids=chunk_ids)
+    else:
+        vectorstore.add_embeddings(list(zip(texts, vectors)), metadatas=metadatas, ids=chunk_ids)
+    return vectorstore, chunk_ids
+
+
+def build_library(pdf_files, processing_mode="hf_no_token", reporter=None, embeddings_loader=None, workers=None):
+    """Build one library store from (name, bytes) PDFs, embedding several documents at a time.
+
+    Every document also lands in the on-disk index cache, so the app loads it without re-embedding.
+    Returns (vectorstore, documents) where documents maps doc IDs to their name and chunk IDs.
+    """
+    reporter = reporter or ProgressReporter()
+    workers = max(1, workers or INGEST_WORKERS)
+
+    unique_files = {}
+    for name, pdf_bytes in pdf_files:
+        unique_files.setdefault(get_document_id(pdf_bytes), (name, pdf_bytes))
+
+    def build(item):
+        doc_id, (name, pdf_bytes) = item
+        return doc_id, name, build_document_vectorstore(name, pdf_bytes, processing_mode, reporter, embeddings_loader)
+
+    vectorstore = None
+    library_model = None
+    documents = {}
+    library_span = Span("index_build", scope="library", trace=new_trace_id())
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # map() keeps upload order, so the library is the same whatever finishes first
+        for doc_id, name, doc_vectorstore in executor.map(build, unique_files.items()):
+            if doc_vectorstore is None:
+                continue
+            doc_model = get_vectorstore_model_name(doc_vectorstore)
+            if vectorstore is not None and doc_model != library_model:
+                reporter.error(f"❌ {name} was embedded with a different model and cannot be combined with the other documents.")
+                continue
+            if vectorstore is None:
+                library_model = doc_model
+            with library_span.measure():
+                vectorstore, chunk_ids = add_document_vectors(vectorstore, doc_vectorstore, doc_id, name)
+            documents[doc_id] = {"name": name, "chunk_ids": chunk_ids}
+
+    if vectorstore is None:
+        library_span.finish()
+        return None, {}
+
+    with library_span.measure():
+        report = optimize_vectorstore(vectorstore)
+    library_span.add(documents=len(documents), vectors=vectorstore.index.ntotal)
+    library_span.finish()
+    if report is not None:
+        reporter.info(f"🧭 Switched to a {report['index_type'].upper()} index for {report['vectors']} chunks: "
+                      f"recall@{report['k']} {report['recall_at_k']:.0%} vs exact search")
+    return vectorstore, documents
+
+
+def save_library(vectorstore, documents, path, dtype=VECTOR_STORAGE_DTYPE):
+    """Write a library as memory-mappable files plus a manifest of its documents and embedding model"""
+    save_mapped_store(vectorstore, path, dtype)
+    manifest = {
+        "model_name": get_vectorstore_model_name(vectorstore),
+        "engine": getattr(vectorstore.embeddings, "engine", None),
+        "documents": documents,
+    }
+    with open(os.path.join(path, "library.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+
+def load_library(path, embeddings_loader=None):
+    """Open a library written by save_library(); returns (vectorstore, documents, model_name).
+
+    The store is memory-mapped and read-only; libraries saved before the mapped format load into memory.
+    """
+    embeddings_loader = embeddings_loader or get_embeddings
+    with open(os.path.join(path, "library.json"), encoding="utf-8") as f:
+        manifest = json.load(f)
+    embeddings = embeddings_loader(manifest["model_name"])
+    if manifest.get("engine") != getattr(embeddings, "engine", None):
+        logger.warning("Library %s was embedded with the %s engine but queries will use %s; results may differ",
+                       path, manifest.get("engine") or "default", getattr(embeddings, "engine", None) or "default")
+    if is_mapped_store(path):
+        vectorstore = load_mapped_store(path, embeddings)
+    else:
+        # Only libraries written by save_library() are read here, so unpickling the docstore is safe
+        vectorstore = FAISS.load_local(path, embeddings, allow_dangerous_deserialization=True)
+    return vectorstore, manifest["documents"], manifest["model_name"]
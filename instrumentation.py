@@ -0,0 +1,406 @@
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+logger = logging.getLogger(__name__)
+
+# JSON lines file that every finished span is appended to ("" to only log them)
+METRICS_LOG = os.getenv("METRICS_LOG", "")
+# Prometheus text file rewritten as spans finish ("" disables it)
+METRICS_FILE = os.getenv("METRICS_FILE", "")
+# Port for a Prometheus /metrics endpoint next to the app (0 disables it)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+METRICS_FILE_INTERVAL_SECONDS = 1.0
+RECENT_SPANS = 200
+# Histogram buckets for stage durations, in seconds
+DURATION_BUCKETS = [0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+
+def current_rss_bytes():
+    """Resident set size of this process"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # No /proc (macOS, Windows): fall back to the process-wide peak
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class MetricsRegistry:
+    """Process-wide aggregates of finished spans, plus the most recent ones for the debug panel"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._gauges = {}
+        self.recent = deque(maxlen=RECENT_SPANS)
+        self._file_written = 0.0
+
+    def record(self, span):
+        with self._lock:
+            stage = self._stages.setdefault(span["stage"], {
+                "count": 0,
+                "errors": 0,
+                "seconds": 0.0,
+                "buckets": [0] * len(DURATION_BUCKETS),
+                "counts": {},
+                "rss_delta_bytes": 0,
+            })
+            stage["count"] += 1
+            stage["errors"] += 1 if span.get("error") else 0
+            stage["seconds"] += span["seconds"]
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if span["seconds"] <= bound:
+                    stage["buckets"][i] += 1
+            for name, value in span["counts"].items():
+                stage["counts"][name] = stage["counts"].get(name, 0) + value
+            stage["rss_delta_bytes"] = span["rss_delta_bytes"]
+            self.recent.append(span)
+            write_file = METRICS_FILE and time.time() - self._file_written >= METRICS_FILE_INTERVAL_SECONDS
+            if write_file:
+                self._file_written = time.time()
+
+        line = json.dumps(span)
+        logger.info(line)
+        if METRICS_LOG:
+            try:
+                with open(METRICS_LOG, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+            except OSError as e:
+                logger.warning("Could not write span log %s: %s", METRICS_LOG, e)
+        if write_file:
+            self.write_prometheus_file(METRICS_FILE)
+
+    def set_gauge(self, name, value, help_text, **labels):
+        """Set the current value of a gauge such as a queue depth, per label combination"""
+        with self._lock:
+            gauge = self._gauges.setdefault(name, {"help": help_text, "values": {}})
+            gauge["values"][tuple(sorted(labels.items()))] = value
+
+    def summary(self):
+        """Per-stage count, total and mean seconds, and summed counts"""
+        with self._lock:
+            return {
+                name: {
+                    "count": stage["count"],
+                    "errors": stage["errors"],
+                    "seconds": stage["seconds"],
+                    "mean_ms": stage["seconds"] * 1000 / stage["count"],
+                    "counts": dict(stage["counts"]),
+                    "rss_delta_bytes": stage["rss_delta_bytes"],
+                }
+                for name, stage in self._stages.items()
+            }
+
+    def render_prometheus(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = [
+            "# HELP chatpdf_stage_seconds Time spent in each pipeline stage.",
+            "# TYPE chatpdf_stage_seconds histogram",
+        ]
+        with self._lock:
+            stages = sorted(self._stages.items())
+            for name, stage in stages:
+                for bound, count in zip(DURATION_BUCKETS, stage["buckets"]):
+                    lines.append(f'chatpdf_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {count}')
+                lines.append(f'chatpdf_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {stage["count"]}')
+                lines.append(f'chatpdf_stage_seconds_sum{{stage="{name}"}} {stage["seconds"]:.6f}')
+                lines.append(f'chatpdf_stage_seconds_count{{stage="{name}"}} {stage["count"]}')
+
+            lines += [
+                "# HELP chatpdf_stage_errors_total Spans that ended with an exception.",
+                "# TYPE chatpdf_stage_errors_total counter",
+            ]
+            lines += [f'chatpdf_stage_errors_total{{stage="{name}"}} {stage["errors"]}' for name, stage in stages]
+
+            lines += [
+                "# HELP chatpdf_stage_items_total Pages, chunks, documents or tokens handled per stage.",
+                "# TYPE chatpdf_stage_items_total counter",
+            ]
+            for name, stage in stages:
+                for item, value in sorted(stage["counts"].items()):
+                    lines.append(f'chatpdf_stage_items_total{{stage="{name}",item="{item}"}} {value}')
+
+            lines += [
+                "# HELP chatpdf_stage_rss_delta_bytes RSS change over the most recent span of each stage.",
+                "# TYPE chatpdf_stage_rss_delta_bytes gauge",
+            ]
+            lines += [f'chatpdf_stage_rss_delta_bytes{{stage="{name}"}} {stage["rss_delta_bytes"]}'
+                      for name, stage in stages]
+
+            for name, gauge in sorted(self._gauges.items()):
+                lines += [f"# HELP chatpdf_{name} {gauge['help']}", f"# TYPE chatpdf_{name} gauge"]
+                for labels, value in sorted(gauge["values"].items()):
+                    label_text = ",".join(f'{key}="{label}"' for key, label in labels)
+                    lines.append(f"chatpdf_{name}{{{label_text}}} {value}")
+
+        lines += [
+            "# HELP chatpdf_process_rss_bytes Resident set size of the app process.",
+            "# TYPE chatpdf_process_rss_bytes gauge",
+            f"chatpdf_process_rss_bytes {current_rss_bytes()}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus_file(self, path):
+        # Write and rename so a scraper never reads a half-written file
+        directory = os.path.dirname(os.path.abspath(path))
+        try:
+            fd, tmp_path = tempfile.mkstemp(prefix=".metrics-", dir=directory)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(self.render_prometheus())
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning("Could not write metrics file %s: %s", path, e)
+
+
+METRICS = MetricsRegistry()
+
+_local = threading.local()
+
+
+def _timing_stack():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+class Span:
+    """One stage's work, which may be spread over several timed slices.
+
+    Time is exclusive: a slice nested inside another span's slice (extraction pulled
+    by chunking, say) is only counted once, for the innermost span. Use it as a
+    with block, or call measure()/iterate() repeatedly and finish() at the end.
+    """
+
+    def __init__(self, stage, **attributes):
+        self.stage = stage
+        self.attributes = attributes
+        self.counts = {}
+        self.seconds = 0.0
+        self.started = time.time()
+        self._start_rss = current_rss_bytes()
+        self._finished = False
+
+    def add(self, **counts):
+        for name, value in counts.items():
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    @contextmanager
+    def measure(self):
+        stack = _timing_stack()
+        # Seconds spent in slices nested inside this one
+        nested = [0.0]
+        stack.append(nested)
+        started = time.perf_counter()
+        try:
+            yield self
+        finally:
+            elapsed = time.perf_counter() - started
+            stack.pop()
+            self.seconds += elapsed - nested[0]
+            if stack:
+                stack[-1][0] += elapsed
+
+    def iterate(self, iterable, count=None):
+        """Yield from iterable, timing only the work of producing each item"""
+        iterator = iter(iterable)
+        while True:
+            with self.measure():
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            if count:
+                self.add(**{count: 1})
+            yield item
+
+    def finish(self, error=None):
+        if self._finished:
+            return
+        self._finished = True
+        METRICS.record({
+            "stage": self.stage,
+            "started": self.started,
+            "seconds": round(self.seconds, 6),
+            "counts": self.counts,
+            "rss_delta_bytes": current_rss_bytes() - self._start_rss,
+            "error": error,
+            **self.attributes,
+        })
+
+    def __enter__(self):
+        self._slice = self.measure()
+        self._slice.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._slice.__exit__(exc_type, exc, tb)
+        self.finish(error=repr(exc) if exc is not None else None)
+        return False
+
+
+def new_trace_id():
+    """Short ID shared by the spans of one document or one question"""
+    return uuid.uuid4().hex[:16]
+
+
+def record_span(stage, seconds, counts=None, error=None, **attributes):
+    """Record a span timed elsewhere, such as between two callbacks"""
+    METRICS.record({
+        "stage": stage,
+        "started": time.time() - seconds,
+        "seconds": round(seconds, 6),
+        "counts": counts or {},
+        "rss_delta_bytes": 0,
+        "error": error,
+        **attributes,
+    })
+
+
+class ChainSpanHandler(BaseCallbackHandler):
+    """Turns a LangChain run into retrieval, condense and generation spans.
+
+    LLM calls are attributed by the "condense" or "generation" tag on the sub-chain they run
+    under (see tag_chain_stages); chain tags are not inherited, so parent runs are tracked.
+    condense_seconds adds up the time spent condensing the question, for per-turn metrics.
+    With a token_counter, prompts are counted in tokens when the provider reports no usage.
+    """
+
+    def __init__(self, token_counter=None, **attributes):
+        self.attributes = attributes
+        self.token_counter = token_counter
+        self.condense_seconds = 0.0
+        self._runs = {}
+        self._chains = {}
+        self._condensing = {}
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, tags=None, **kwargs):
+        stage = next((tag for tag in tags or [] if tag in ("condense", "generation")), None)
+        self._chains[run_id] = (parent_run_id, stage)
+        if stage == "condense":
+            self._condensing[run_id] = time.perf_counter()
+
+    def _end_chain(self, run_id):
+        self._chains.pop(run_id, None)
+        started = self._condensing.pop(run_id, None)
+        if started is not None:
+            self.condense_seconds += time.perf_counter() - started
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end_chain(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end_chain(run_id)
+
+    def _llm_stage(self, parent_run_id):
+        while parent_run_id in self._chains:
+            parent_run_id, stage = self._chains[parent_run_id]
+            if stage is not None:
+                return stage
+        return "llm"
+
+    def on_retriever_start(self, serialized, query, *, run_id, **kwargs):
+        self._runs[run_id] = {"started": time.perf_counter()}
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is not None:
+            record_span("retrieval", time.perf_counter() - run["started"], {"documents": len(documents)},
+                        **self.attributes)
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is not None:
+            record_span("retrieval", time.perf_counter() - run["started"], error=repr(error), **self.attributes)
+
+    def _start_llm(self, run_id, parent_run_id, texts):
+        self._runs[run_id] = {
+            "started": time.perf_counter(),
+            "stage": self._llm_stage(parent_run_id),
+            "prompt_chars": sum(len(text) for text in texts),
+            "prompt_tokens": sum(self.token_counter.count_uncached(texts)) if self.token_counter and texts else None,
+            "tokens": 0,
+        }
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, **kwargs):
+        self._start_llm(run_id, parent_run_id, prompts)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, **kwargs):
+        self._start_llm(run_id, parent_run_id, [str(message.content) for batch in messages for message in batch])
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        run = self._runs.get(run_id)
+        if run is not None:
+            run["tokens"] += 1
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        counts = {"prompt_chars": run["prompt_chars"]}
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        if usage:
+            counts["prompt_tokens"] = usage.get("prompt_tokens", 0)
+            counts["completion_tokens"] = usage.get("completion_tokens", 0)
+        else:
+            if run["prompt_tokens"] is not None:
+                counts["prompt_tokens"] = run["prompt_tokens"]
+            if run["tokens"]:
+                counts["completion_tokens"] = run["tokens"]
+        record_span(run["stage"], time.perf_counter() - run["started"], counts, **self.attributes)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is not None:
+            record_span(run["stage"], time.perf_counter() - run["started"], error=repr(error), **self.attributes)
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = METRICS.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port=None):
+    """Serve /metrics on its own port in a daemon thread; returns the server, or None if disabled"""
+    port = METRICS_PORT if port is None else port
+    if not port:
+        return None
+    try:
+        server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsRequestHandler)
+    except OSError as e:
+        logger.warning("Could not start metrics endpoint on port %d: %s", port, e)
+        return None
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info("Serving Prometheus metrics on port %d", port)
+    return server
+
+
+def tag_chain_stages(chain):
+    """Tag a ConversationalRetrievalChain's sub-chains so ChainSpanHandler can tell condensing from generation"""
+    chain.question_generator.tags = (chain.question_generator.tags or []) + ["condense"]
+    chain.combine_docs_chain.tags = (chain.combine_docs_chain.tags or []) + ["generation"]
+    return chain
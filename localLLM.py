@@ -0,0 +1,158 @@
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, List, Optional
+
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models.llms import LLM
+
+from instrumentation import Span
+
+logger = logging.getLogger(__name__)
+
+# In-process model for the "local" processing mode; the same model the public endpoint serves
+LOCAL_LLM_MODEL = os.getenv("LOCAL_LLM_MODEL", "google/flan-t5-small")
+# Dynamic int8 quantization of the Linear layers: smaller and usually faster on CPU, slightly less accurate
+LOCAL_LLM_INT8 = os.getenv("LOCAL_LLM_INT8", "false").lower() == "true"
+# Prompts from concurrent sessions generated together, and how long to wait for a batch to fill
+LOCAL_LLM_MAX_BATCH = int(os.getenv("LOCAL_LLM_MAX_BATCH", "8"))
+LOCAL_LLM_BATCH_WAIT_MS = float(os.getenv("LOCAL_LLM_BATCH_WAIT_MS", "20"))
+# Torch intra-op threads (0 keeps torch's default of one per core)
+LOCAL_LLM_THREADS = int(os.getenv("LOCAL_LLM_THREADS", "0"))
+
+MAX_NEW_TOKENS = 100
+# flan-t5 was trained on inputs of up to 512 tokens
+MAX_INPUT_TOKENS = 512
+
+
+class LocalSeq2SeqEngine:
+    """A seq2seq model on CPU, shared by every session, that generates queued prompts in batches.
+
+    One worker thread takes the first waiting prompt, gives others up to batch_wait_ms to
+    arrive, and runs a single padded generate() for all of them.
+    """
+
+    def __init__(self, model_name=LOCAL_LLM_MODEL, int8=LOCAL_LLM_INT8, max_batch=LOCAL_LLM_MAX_BATCH,
+                 batch_wait_ms=LOCAL_LLM_BATCH_WAIT_MS, threads=LOCAL_LLM_THREADS):
+        self.model_name = model_name
+        self.int8 = int8
+        self.max_batch = max(1, max_batch)
+        self.batch_wait = batch_wait_ms / 1000.0
+        self.threads = threads
+        self._queue = queue.Queue()
+        self.tokenizer = None
+        self.model = None
+        self.batches = 0
+        self.prompts = 0
+
+    def _load(self):
+        import torch
+        from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
+
+        if self.threads:
+            torch.set_num_threads(self.threads)
+        tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        # Prompts end with the question, so overlong ones lose context from the front instead
+        tokenizer.truncation_side = "left"
+        model = AutoModelForSeq2SeqLM.from_pretrained(self.model_name)
+        model.eval()
+        if self.int8:
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        return tokenizer, model
+
+    def start(self):
+        """Load the model (raising if that fails) and start the batching thread"""
+        started = time.perf_counter()
+        self.tokenizer, self.model = self._load()
+        logger.info("Loaded %s%s in %.1f s", self.model_name, " (int8)" if self.int8 else "",
+                    time.perf_counter() - started)
+        threading.Thread(target=self._run, name="local-llm", daemon=True).start()
+        return self
+
+    def generate(self, prompt, max_new_tokens=MAX_NEW_TOKENS):
+        """Queue a prompt and wait for its completion"""
+        future = Future()
+        self._queue.put((prompt, max_new_tokens, future))
+        return future.result()
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                texts = self._generate_batch([prompt for prompt, _, _ in batch],
+                                             max(max_new_tokens for _, max_new_tokens, _ in batch))
+            except Exception as e:
+                for _, _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, _, future), text in zip(batch, texts):
+                future.set_result(text)
+
+    def _generate_batch(self, prompts, max_new_tokens):
+        import torch
+
+        with Span("local_llm_batch", model=self.model_name) as span:
+            inputs = self.tokenizer(prompts, return_tensors="pt", padding=True, truncation=True,
+                                    max_length=MAX_INPUT_TOKENS)
+            with torch.inference_mode():
+                outputs = self.model.generate(**inputs, max_new_tokens=max_new_tokens)
+            span.add(prompts=len(prompts), input_tokens=int(inputs["attention_mask"].sum()),
+                     output_tokens=int((outputs != self.tokenizer.pad_token_id).sum()))
+        self.batches += 1
+        self.prompts += len(prompts)
+        return self.tokenizer.batch_decode(outputs, skip_special_tokens=True)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "prompts": self.prompts,
+            "mean_batch_size": self.prompts / self.batches if self.batches else 0.0,
+            "queued": self._queue.qsize(),
+        }
+
+
+class LocalLLM(LLM):
+    """LangChain LLM backed by a shared LocalSeq2SeqEngine.
+
+    Batched generation returns whole answers, so with streaming on the answer reaches
+    callbacks as a single token once it is done.
+    """
+
+    engine: Any
+    max_new_tokens: int = MAX_NEW_TOKENS
+    streaming: bool = False
+
+    @property
+    def _llm_type(self):
+        return "local_seq2seq"
+
+    @property
+    def _identifying_params(self):
+        return {"model_name": self.engine.model_name, "int8": self.engine.int8,
+                "max_new_tokens": self.max_new_tokens}
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None,
+              run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> str:
+        text = self.engine.generate(prompt, self.max_new_tokens)
+        if stop:
+            for sequence in stop:
+                text = text.split(sequence)[0]
+        if self.streaming and run_manager is not None:
+            run_manager.on_llm_new_token(text)
+        return text
@@ -0,0 +1,184 @@
+import json
+import logging
+import mmap
+import os
+from collections.abc import Mapping
+
+import faiss
+import numpy as np
+from langchain_community.docstore.base import Docstore
+from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_core.documents import Document
+
+from vectorIndex import HNSW_EF_SEARCH, HNSW_NEIGHBORS, build_index, get_index_type, reconstruct_vectors
+
+logger = logging.getLogger(__name__)
+
+# How saved libraries store their vectors: "float32" (exact), "float16" (half the size) or "int8" (a quarter)
+VECTOR_STORAGE_DTYPE = os.getenv("VECTOR_STORAGE_DTYPE", "float32").lower()
+
+STORAGE_DTYPES = ("float32", "float16", "int8")
+_SCALAR_QUANTIZERS = {"float16": faiss.ScalarQuantizer.QT_fp16, "int8": faiss.ScalarQuantizer.QT_8bit}
+
+# Bump when the file layout changes so old stores are rejected instead of misread
+STORE_FORMAT_VERSION = 1
+_MANIFEST = "store.json"
+_INDEX = "index.faiss"
+_CHUNKS = "chunks.bin"
+_OFFSETS = "chunk_offsets.npy"
+_IDS = "ids.npy"
+_ID_ORDER = "id_order.npy"
+
+
+def build_compact_index(vectors, index_type, dtype):
+    """Flat or HNSW index over vectors stored as float32, float16 or per-dimension 8-bit codes"""
+    if dtype not in STORAGE_DTYPES:
+        raise ValueError(f"Unknown vector storage dtype: {dtype}")
+    if dtype == "float32":
+        return build_index(vectors, index_type)
+
+    dim = vectors.shape[1]
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWSQ(dim, _SCALAR_QUANTIZERS[dtype], HNSW_NEIGHBORS)
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+    else:
+        index = faiss.IndexScalarQuantizer(dim, _SCALAR_QUANTIZERS[dtype], faiss.METRIC_L2)
+    index.train(vectors)
+    index.add(vectors)
+    return index
+
+
+def save_mapped_store(vectorstore, path, dtype=VECTOR_STORAGE_DTYPE):
+    """Write a FAISS store as files that load_mapped_store() memory-maps instead of reading.
+
+    Flat and HNSW indexes are re-encoded in dtype; IVF-PQ already holds compressed codes and is
+    written as it is. Chunks are JSON records in one file, found through an offsets array.
+    """
+    os.makedirs(path, exist_ok=True)
+    index_type = get_index_type(vectorstore.index)
+    if index_type == "ivfpq":
+        index = vectorstore.index
+    else:
+        index = build_compact_index(reconstruct_vectors(vectorstore.index), index_type, dtype)
+    faiss.write_index(index, os.path.join(path, _INDEX))
+
+    ids = [vectorstore.index_to_docstore_id[i] for i in range(vectorstore.index.ntotal)]
+    offsets = [0]
+    with open(os.path.join(path, _CHUNKS), "wb") as f:
+        for doc_id in ids:
+            chunk = vectorstore.docstore.search(doc_id)
+            record = json.dumps({"text": chunk.page_content, "metadata": chunk.metadata}).encode("utf-8")
+            f.write(record)
+            offsets.append(offsets[-1] + len(record))
+    np.save(os.path.join(path, _OFFSETS), np.asarray(offsets, dtype=np.int64))
+    encoded_ids = np.asarray([doc_id.encode("utf-8") for doc_id in ids], dtype=np.bytes_)
+    np.save(os.path.join(path, _IDS), encoded_ids)
+    np.save(os.path.join(path, _ID_ORDER), np.argsort(encoded_ids, kind="stable").astype(np.int64))
+
+    manifest = {
+        "version": STORE_FORMAT_VERSION,
+        "dtype": dtype if index_type != "ivfpq" else "pq",
+        "index_type": index_type,
+        "vectors": index.ntotal,
+        "dim": index.d,
+        "normalize_L2": vectorstore._normalize_L2,
+        "distance_strategy": vectorstore.distance_strategy.value,
+    }
+    with open(os.path.join(path, _MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    logger.info("Saved %d vectors (%s) to %s", index.ntotal, manifest["dtype"], path)
+
+
+def is_mapped_store(path):
+    return os.path.exists(os.path.join(path, _MANIFEST))
+
+
+class MappedIds(Mapping):
+    """Read-only index position -> chunk ID mapping backed by a memory-mapped array"""
+
+    def __init__(self, ids):
+        self._ids = ids
+
+    def __getitem__(self, position):
+        if not 0 <= position < len(self._ids):
+            raise KeyError(position)
+        return self._ids[position].decode("utf-8")
+
+    def __iter__(self):
+        return iter(range(len(self._ids)))
+
+    def __len__(self):
+        return len(self._ids)
+
+
+class MappedDocstore(Docstore):
+    """Read-only chunk store over memory-mapped files; a chunk is only decoded when it is looked up"""
+
+    def __init__(self, path):
+        self.ids = np.load(os.path.join(path, _IDS), mmap_mode="r")
+        self._order = np.load(os.path.join(path, _ID_ORDER), mmap_mode="r")
+        self._offsets = np.load(os.path.join(path, _OFFSETS), mmap_mode="r")
+        with open(os.path.join(path, _CHUNKS), "rb") as f:
+            # mmap cannot map an empty file
+            self._chunks = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self._offsets[-1] else b""
+
+    def __len__(self):
+        return len(self.ids)
+
+    def position(self, doc_id):
+        """Index position of a chunk ID, found by binary search, or None"""
+        key = doc_id.encode("utf-8")
+        i = int(np.searchsorted(self.ids, key, sorter=self._order))
+        if i < len(self._order) and self.ids[self._order[i]] == key:
+            return int(self._order[i])
+        return None
+
+    def document(self, position):
+        record = json.loads(self._chunks[self._offsets[position]:self._offsets[position + 1]])
+        return Document(page_content=record["text"], metadata=record["metadata"])
+
+    def search(self, search):
+        position = self.position(search)
+        if position is None:
+            return f"ID {search} not found."
+        return self.document(position)
+
+    def delete(self, ids):
+        raise NotImplementedError("Memory-mapped stores are read-only; copy the store to change it")
+
+    def to_dict(self):
+        """Every chunk by ID, decoded into memory"""
+        return {self.ids[i].decode("utf-8"): self.document(i) for i in range(len(self))}
+
+
+class MappedFAISS(FAISS):
+    """FAISS store over memory-mapped files, which must not be written to"""
+
+    def delete(self, ids=None, **kwargs):
+        # FAISS would otherwise remove vectors from the read-only mapping before checking the docstore
+        raise NotImplementedError("Memory-mapped stores are read-only; copy the store to change it")
+
+
+def load_mapped_store(path, embeddings):
+    """Open a store written by save_mapped_store() without reading its vectors or chunks into memory.
+
+    Vectors and chunk texts stay in the page cache, so processes that open the same store share
+    them; the returned store is read-only (see indexRegistry.copy_vectorstore to change it).
+    """
+    with open(os.path.join(path, _MANIFEST), encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != STORE_FORMAT_VERSION:
+        raise ValueError(f"Unsupported vector store format in {path}: {manifest.get('version')}")
+
+    # Flat and scalar-quantized codes (also HNSW storage) are mapped; graphs and IVF lists are read
+    index = faiss.read_index(os.path.join(path, _INDEX), faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+    docstore = MappedDocstore(path)
+    return MappedFAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=MappedIds(docstore.ids),
+        normalize_L2=manifest["normalize_L2"],
+        distance_strategy=DistanceStrategy(manifest["distance_strategy"]),
+    )
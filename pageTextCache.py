@@ -0,0 +1,105 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+# Where extracted page text is cached per PDF ("" disables it) and how much disk it may use in total
+PAGE_TEXT_CACHE_DIR = os.getenv("PAGE_TEXT_CACHE_DIR", ".page_text_cache")
+PAGE_TEXT_CACHE_MAX_MB = float(os.getenv("PAGE_TEXT_CACHE_MAX_MB", "256"))
+
+# Bump when the entry layout changes so stale entries are never loaded
+PAGE_CACHE_FORMAT_VERSION = 1
+
+
+def get_page_cache_key(pdf_bytes, extractors):
+    """Content-addressed key for one PDF's page text as extracted by extractors (names and versions)"""
+    digest = hashlib.sha256(pdf_bytes)
+    digest.update(f"pages-v{PAGE_CACHE_FORMAT_VERSION}:{extractors}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _entry_path(cache_key):
+    return os.path.join(PAGE_TEXT_CACHE_DIR, cache_key + ".json")
+
+
+def load_pages(cache_key):
+    """Cached text of every page, in page order, or None on a cache miss"""
+    if not PAGE_TEXT_CACHE_DIR:
+        return None
+    path = _entry_path(cache_key)
+    try:
+        with open(path, encoding="utf-8") as f:
+            entry = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning("Discarding unreadable page text cache entry %s: %s", cache_key, e)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return None
+
+    # Touch the entry so LRU eviction sees it as recently used
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return entry["pages"]
+
+
+def save_pages(cache_key, extractor, pages):
+    """Persist a PDF's page texts under its cache key, then enforce the size cap"""
+    if not PAGE_TEXT_CACHE_DIR:
+        return
+    tmp_path = None
+    try:
+        os.makedirs(PAGE_TEXT_CACHE_DIR, exist_ok=True)
+        # Write a temporary file and rename it so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", dir=PAGE_TEXT_CACHE_DIR)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"extractor": extractor, "pages": pages}, f)
+        os.replace(tmp_path, _entry_path(cache_key))
+    except OSError as e:
+        logger.warning("Could not cache page text %s: %s", cache_key, e)
+        if tmp_path is not None:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+        return
+
+    evict_lru(keep=cache_key)
+
+
+def evict_lru(keep=None):
+    """Delete least recently used entries until the cache fits in PAGE_TEXT_CACHE_MAX_MB"""
+    if not os.path.isdir(PAGE_TEXT_CACHE_DIR):
+        return
+
+    entries = []
+    for name in os.listdir(PAGE_TEXT_CACHE_DIR):
+        path = os.path.join(PAGE_TEXT_CACHE_DIR, name)
+        if name.startswith(".") or not name.endswith(".json"):
+            continue
+        try:
+            entries.append((os.path.getmtime(path), name, os.path.getsize(path)))
+        except OSError:
+            continue
+
+    max_bytes = PAGE_TEXT_CACHE_MAX_MB * 1024 * 1024
+    total = sum(size for _, _, size in entries)
+    for _, name, size in sorted(entries):
+        if total <= max_bytes:
+            break
+        if name == f"{keep}.json":
+            continue
+        try:
+            os.remove(os.path.join(PAGE_TEXT_CACHE_DIR, name))
+        except OSError:
+            continue
+        total -= size
+        logger.info("Evicted page text cache entry %s (%d bytes)", name, size)
@@ -0,0 +1,453 @@
+import atexit
+import contextlib
+import functools
+import importlib.metadata
+import importlib.util
+import io
+import logging
+import os
+import tempfile
+import threading
+import uuid
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from PyPDF2 import PdfReader
+
+from pageTextCache import get_page_cache_key, load_pages, save_pages
+
+logger = logging.getLogger(__name__)
+
+# Text extraction library: "auto" tries the installed native ones first (pypdfium2, pymupdf, pypdf2),
+# or list them in order of preference ("pymupdf,pypdf2"); PyPDF2 is always the last fallback
+PDF_EXTRACTOR = os.getenv("PDF_EXTRACTOR", "auto").lower()
+
+# Worker processes used for text extraction (0 or 1 disables the pool)
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(os.cpu_count() or 1)))
+# Pages handed to one worker per task; a smaller PDF goes to a worker whole
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "16"))
+# Page ranges allowed in flight across files, which bounds memory while streaming
+PDF_MAX_PENDING_TASKS = max(1, PDF_EXTRACT_WORKERS) * 2
+
+PageResult = namedtuple("PageResult", ["page_num", "text", "error"])
+# extractor is the library that opened the file, or "cache" for text from the page text cache
+FileResult = namedtuple("FileResult", ["name", "num_pages", "pages", "error", "extractor"], defaults=(None,))
+
+
+class PdfExtractor:
+    """One text extraction library; documents are opened from PDF bytes or a file path"""
+
+    name = None
+    module = None
+    # Native libraries must not be used from several threads at once
+    lock = contextlib.nullcontext()
+
+    def available(self):
+        return importlib.util.find_spec(self.module) is not None
+
+    def version(self):
+        try:
+            return importlib.metadata.version(self.module)
+        except importlib.metadata.PackageNotFoundError:
+            return "unknown"
+
+    def open(self, source):
+        raise NotImplementedError
+
+    def page_count(self, document):
+        raise NotImplementedError
+
+    def page_text(self, document, page_num):
+        raise NotImplementedError
+
+    def close(self, document):
+        pass
+
+
+class PyMuPDFExtractor(PdfExtractor):
+    """MuPDF (C), AGPL-licensed, so an optional install"""
+
+    name = "pymupdf"
+    module = "pymupdf"
+    lock = threading.Lock()
+
+    def open(self, source):
+        import pymupdf
+
+        with self.lock:
+            if isinstance(source, bytes):
+                return pymupdf.open(stream=source, filetype="pdf")
+            return pymupdf.open(source)
+
+    def page_count(self, document):
+        return document.page_count
+
+    def page_text(self, document, page_num):
+        with self.lock:
+            return document[page_num].get_text()
+
+    def close(self, document):
+        with self.lock:
+            document.close()
+
+
+class PdfiumExtractor(PdfExtractor):
+    """Google's PDFium (C++) through pypdfium2: the default, several times faster than PyPDF2"""
+
+    name = "pypdfium2"
+    module = "pypdfium2"
+    lock = threading.Lock()
+
+    def open(self, source):
+        import pypdfium2
+
+        with self.lock:
+            return pypdfium2.PdfDocument(source)
+
+    def page_count(self, document):
+        return len(document)
+
+    def page_text(self, document, page_num):
+        with self.lock:
+            page = document[page_num]
+            textpage = page.get_textpage()
+            try:
+                text = textpage.get_text_bounded()
+            finally:
+                textpage.close()
+                page.close()
+        return text.replace("\r\n", "\n")
+
+    def close(self, document):
+        with self.lock:
+            document.close()
+
+
+class PyPDF2Extractor(PdfExtractor):
+    """Pure Python: slowest, but always installed"""
+
+    name = "pypdf2"
+    module = "PyPDF2"
+
+    def open(self, source):
+        return PdfReader(io.BytesIO(source) if isinstance(source, bytes) else source)
+
+    def page_count(self, document):
+        return len(document.pages)
+
+    def page_text(self, document, page_num):
+        return document.pages[page_num].extract_text() or ""
+
+
+EXTRACTORS = {extractor.name: extractor for extractor in (PdfiumExtractor(), PyMuPDFExtractor(), PyPDF2Extractor())}
+
+
+@functools.lru_cache(maxsize=None)
+def get_extractor_names(setting=PDF_EXTRACTOR):
+    """Installed extractors in order of preference, ending with PyPDF2"""
+    requested = list(EXTRACTORS) if setting == "auto" else [name.strip() for name in setting.split(",") if name.strip()]
+    names = []
+    for name in requested + ["pypdf2"]:
+        if name not in EXTRACTORS:
+            logger.warning("Ignoring unknown PDF extractor %r", name)
+        elif name not in names and EXTRACTORS[name].available():
+            names.append(name)
+    return tuple(names)
+
+
+@functools.lru_cache(maxsize=None)
+def get_extractor_fingerprint(setting=PDF_EXTRACTOR):
+    """The extractors in use with their library versions, so their cached page text is kept apart"""
+    return ",".join(f"{name}=={EXTRACTORS[name].version()}" for name in get_extractor_names(setting))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    """Lazily start one process pool shared by every session"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=PDF_EXTRACT_WORKERS)
+            atexit.register(_executor.shutdown, wait=False, cancel_futures=True)
+        return _executor
+
+
+def _reset_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def _extract_pages(names, open_document, start, stop):
+    """Pages [start, stop) with the first extractor in names, retrying a failing page with the others"""
+    results = []
+    for page_num in range(start, stop):
+        error = None
+        for name in names:
+            try:
+                results.append(PageResult(page_num, EXTRACTORS[name].page_text(open_document(name), page_num), None))
+                break
+            except Exception as e:
+                error = error or str(e)
+        else:
+            results.append(PageResult(page_num, "", error))
+    return results
+
+
+def _document_opener(source, documents=None):
+    """open_document(name) for _extract_pages that opens source once per extractor"""
+    documents = {} if documents is None else documents
+
+    def open_document(name):
+        if name not in documents:
+            documents[name] = EXTRACTORS[name].open(source)
+        return documents[name]
+
+    return open_document
+
+
+def _close_documents(documents):
+    for name, document in documents.items():
+        try:
+            EXTRACTORS[name].close(document)
+        except Exception as e:
+            logger.debug("Could not close a %s document: %s", name, e)
+    documents.clear()
+
+
+# Uploads with page ranges in flight, by upload ID; workers drop their documents for any other upload
+_live_uploads = set()
+_live_uploads_lock = threading.Lock()
+# A worker's open documents, {upload ID: {extractor name: document}}
+_worker_documents = {}
+
+
+def _worker_document_opener(pdf_path, upload_id, live_uploads):
+    """open_document(name) that reuses this worker's documents for an upload across its page ranges"""
+    for other_id in [other_id for other_id in _worker_documents if other_id not in live_uploads]:
+        _close_documents(_worker_documents.pop(other_id))
+    documents = _worker_documents.setdefault(upload_id, {})
+
+    def open_document(name):
+        if name not in documents:
+            # Parse from memory: no handle stays open on the temp file, which the parent deletes when done
+            with open(pdf_path, "rb") as f:
+                documents[name] = EXTRACTORS[name].open(f.read())
+        return documents[name]
+
+    return open_document
+
+
+def extract_page_range(source, upload_id, live_uploads, names, start, stop):
+    """Extract pages [start, stop) of a PDF; a failing page never aborts the others.
+
+    source is the PDF's bytes for a file that fits in one range, otherwise the temp file
+    its ranges share, whose documents this worker keeps while upload_id is live.
+    """
+    if upload_id is not None:
+        return _extract_pages(names, _worker_document_opener(source, upload_id, live_uploads), start, stop)
+    documents = {}
+    try:
+        return _extract_pages(names, _document_opener(source, documents), start, stop)
+    finally:
+        _close_documents(documents)
+
+
+def _open_file(pdf_bytes):
+    """Open a PDF with the first extractor that can read it.
+
+    Returns (that extractor and the fallbacks after it, page count, {name: open document}).
+    """
+    names = get_extractor_names()
+    error = None
+    for i, name in enumerate(names):
+        try:
+            document = EXTRACTORS[name].open(pdf_bytes)
+            return names[i:], EXTRACTORS[name].page_count(document), {name: document}
+        except Exception as e:
+            logger.info("%s could not open the PDF: %s", name, e)
+            error = error or e
+    raise error
+
+
+class _FileJob:
+    """One PDF on its way through extraction: its page ranges still to submit and those in flight"""
+
+    def __init__(self, name, pdf_bytes, use_pool):
+        self.name = name
+        self.pdf_bytes = pdf_bytes
+        self.cache_key = get_page_cache_key(pdf_bytes, get_extractor_fingerprint())
+        # Set instead for files served from the page text cache or that could not be opened
+        self.result = None
+        self.names = ()
+        self.num_pages = 0
+        self.documents = {}
+        self.ranges = deque()
+        self.futures = deque()
+        self.source = pdf_bytes
+        self.upload_id = None
+
+        cached = load_pages(self.cache_key)
+        if cached is not None:
+            pages = iter([PageResult(page_num, text, None) for page_num, text in enumerate(cached)])
+            self.result = FileResult(name, len(cached), pages, None, "cache")
+            return
+        try:
+            self.names, self.num_pages, self.documents = _open_file(pdf_bytes)
+        except Exception as e:
+            self.result = FileResult(name, 0, iter(()), str(e))
+            return
+        if not use_pool:
+            return
+
+        self.ranges.extend((start, min(start + PDF_PAGES_PER_TASK, self.num_pages))
+                           for start in range(0, self.num_pages, PDF_PAGES_PER_TASK))
+        if len(self.ranges) > 1:
+            # Workers read a longer PDF from a temp file instead of receiving its bytes with every task
+            fd, self.source = tempfile.mkstemp(suffix=".pdf")
+            with os.fdopen(fd, "wb") as f:
+                f.write(pdf_bytes)
+            self.upload_id = uuid.uuid4().hex
+            with _live_uploads_lock:
+                _live_uploads.add(self.upload_id)
+
+    def submit_next(self, executor):
+        start, stop = self.ranges.popleft()
+        with _live_uploads_lock:
+            live_uploads = frozenset(_live_uploads)
+        self.futures.append(executor.submit(
+            extract_page_range, self.source, self.upload_id, live_uploads, self.names, start, stop))
+
+    def cancel(self):
+        for future in self.futures:
+            future.cancel()
+        self.futures.clear()
+        self.ranges.clear()
+
+    def close(self):
+        self.cancel()
+        _close_documents(self.documents)
+        if self.upload_id is None:
+            return
+        with _live_uploads_lock:
+            _live_uploads.discard(self.upload_id)
+        self.upload_id = None
+        try:
+            os.remove(self.source)
+        except OSError as e:
+            logger.warning("Could not delete temporary PDF %s: %s", self.source, e)
+
+
+class _Lookahead:
+    """Opens files ahead of the one being read and keeps the pool busy with page ranges across them.
+
+    At most PDF_MAX_PENDING_TASKS ranges are in flight and as many files open ahead, so memory
+    stays bounded however many files there are, while a batch of short PDFs is still spread
+    over every worker.
+    """
+
+    def __init__(self, pdf_files):
+        self._files = iter(pdf_files)
+        self._use_pool = PDF_EXTRACT_WORKERS > 1
+        self.current = None
+        self.upcoming = deque()
+
+    def _open_next(self):
+        item = next(self._files, None)
+        if item is None:
+            return False
+        self.upcoming.append(_FileJob(*item, self._use_pool))
+        return True
+
+    def next_job(self):
+        if self.current is not None:
+            self.current.close()
+        if not self.upcoming:
+            self._open_next()
+        self.current = self.upcoming.popleft() if self.upcoming else None
+        return self.current
+
+    def fill(self):
+        """Submit ranges in file order, opening further files as needed, until the pool has enough queued"""
+        if not self._use_pool:
+            return
+        jobs = [self.current] + list(self.upcoming)
+        in_flight = sum(len(job.futures) for job in jobs)
+        while in_flight < PDF_MAX_PENDING_TASKS:
+            job = next((job for job in jobs if job.ranges), None)
+            if job is None:
+                if len(self.upcoming) >= PDF_MAX_PENDING_TASKS or not self._open_next():
+                    return
+                jobs.append(self.upcoming[-1])
+                continue
+            job.submit_next(_get_executor())
+            in_flight += 1
+
+    def close(self):
+        for job in [self.current] + list(self.upcoming):
+            if job is not None:
+                job.close()
+        self.current = None
+        self.upcoming.clear()
+
+
+def _iter_job_pages(lookahead, job):
+    """Pages of the lookahead's current file, in order, topping the pool up as each range is taken"""
+    next_page = 0
+    try:
+        try:
+            lookahead.fill()
+            while job.futures:
+                future = job.futures.popleft()
+                lookahead.fill()
+                for page in future.result():
+                    next_page = page.page_num + 1
+                    yield page
+        except Exception as e:
+            # A broken pool (e.g. a worker killed by the OS) falls back to in-process extraction
+            logger.warning("Parallel PDF extraction failed, extracting serially: %s", e)
+            _reset_executor()
+            job.cancel()
+        yield from _extract_pages(job.names, _document_opener(job.pdf_bytes, job.documents), next_page, job.num_pages)
+    finally:
+        job.close()
+
+
+def _cache_pages(cache_key, extractor_name, pages):
+    """Pass pages through, saving their text once every page has been extracted without errors"""
+    texts = []
+    for page in pages:
+        texts.append(None if page.error else page.text)
+        yield page
+    if None not in texts:
+        save_pages(cache_key, extractor_name, texts)
+
+
+def iter_pdf_pages(pdf_files):
+    """Yield one FileResult per (name, bytes) pair, in input order, with lazily extracted pages.
+
+    Files whose text was extracted before come from the page text cache. Otherwise pages
+    come from the process pool, which already works on the next files' page ranges while
+    one file's pages are read, with a bounded number of ranges in flight. Consume one
+    file's pages before moving on to the next file.
+    """
+    lookahead = _Lookahead(pdf_files)
+    try:
+        while lookahead.next_job() is not None:
+            job = lookahead.current
+            if job.result is not None:
+                yield job.result
+                continue
+            pages = _cache_pages(job.cache_key, job.names[0], _iter_job_pages(lookahead, job))
+            yield FileResult(job.name, job.num_pages, pages, None, job.names[0])
+    finally:
+        lookahead.close()
+
+
+def extract_pdf_pages(pdf_files):
+    """Extract every page of (name, bytes) pairs into fully materialized FileResults"""
+    return [result._replace(pages=list(result.pages)) for result in iter_pdf_pages(pdf_files)]
@@ -0,0 +1,166 @@
+import logging
+import os
+import re
+import time
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+# How the local MiniLM model is run: "torch" (full precision, HuggingFaceInstructEmbeddings),
+# "torch_int8" (PyTorch dynamic int8 quantization) or "onnx_int8" (ONNX Runtime with int8 weights)
+EMBEDDING_ENGINE = os.getenv("EMBEDDING_ENGINE", "torch")
+# CPU threads for the int8 engines (0 keeps the runtime's default of one per core)
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0"))
+# Exported and quantized ONNX models are written here once and reused
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", ".onnx_models")
+# Smallest share of the reference model's top-k results an engine must return to pass the parity check
+EMBEDDING_PARITY_MIN_RECALL = float(os.getenv("EMBEDDING_PARITY_MIN_RECALL", "0.9"))
+
+INT8_ENGINES = ("torch_int8", "onnx_int8")
+
+# Same instructions and input length as HuggingFaceInstructEmbeddings, so vectors stay comparable
+EMBED_INSTRUCTION = "Represent the document for retrieval: "
+QUERY_INSTRUCTION = "Represent the question for retrieving supporting documents: "
+MAX_SEQ_LENGTH = 512
+
+
+class QuantizedEmbeddings(Embeddings):
+    """A sentence-transformers encoder run with int8 weights, pooled the way INSTRUCTOR pools it.
+
+    Each text is prefixed with its instruction, encoded, and mean-pooled over the text's own
+    tokens only, then L2-normalized. Batches are sorted by length to keep padding small.
+    """
+
+    def __init__(self, model_name, engine="onnx_int8", threads=EMBEDDING_THREADS, batch_size=64):
+        if engine not in INT8_ENGINES:
+            raise ValueError(f"Unknown embedding engine: {engine}")
+        self.model_name = model_name
+        self.engine = engine
+        self.threads = threads
+        self.batch_size = max(1, batch_size)
+        started = time.perf_counter()
+        self.tokenizer = self._load_tokenizer()
+        self._encode = self._load_onnx() if engine == "onnx_int8" else self._load_torch()
+        logger.info("Loaded %s with the %s engine in %.1f s", model_name, engine, time.perf_counter() - started)
+
+    def _load_tokenizer(self):
+        from transformers import AutoTokenizer
+
+        return AutoTokenizer.from_pretrained(self.model_name)
+
+    def _load_torch(self):
+        import torch
+        from transformers import AutoModel
+
+        if self.threads:
+            torch.set_num_threads(self.threads)
+        model = AutoModel.from_pretrained(self.model_name)
+        model.eval()
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+        def encode(inputs):
+            with torch.inference_mode():
+                return model(**{name: torch.from_numpy(array) for name, array in inputs.items()})[0].numpy()
+
+        return encode
+
+    def _onnx_path(self):
+        return os.path.join(ONNX_MODEL_DIR, re.sub(r"[^\w.-]", "_", self.model_name), "model-int8.onnx")
+
+    def _export_onnx(self, path):
+        """Export the encoder to ONNX and quantize its weights to int8"""
+        import torch
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        from transformers import AutoModel
+
+        model = AutoModel.from_pretrained(self.model_name)
+        model.eval()
+        # A padded sample, so the attention mask is traced as a real input rather than folded away
+        sample = self.tokenizer(["warm-up", "a longer warm-up input"], padding=True, return_tensors="pt")
+        fp32_path = path.replace("-int8.onnx", "-fp32.onnx")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        torch.onnx.export(
+            model, (), fp32_path, kwargs=dict(sample), external_data=False,
+            dynamic_shapes={name: {0: torch.export.Dim.AUTO, 1: torch.export.Dim.AUTO} for name in sample},
+        )
+        quantize_dynamic(fp32_path, path, weight_type=QuantType.QInt8)
+        os.remove(fp32_path)
+        logger.info("Exported %s to %s", self.model_name, path)
+
+    def _load_onnx(self):
+        import onnxruntime
+
+        path = self._onnx_path()
+        if not os.path.exists(path):
+            self._export_onnx(path)
+        options = onnxruntime.SessionOptions()
+        if self.threads:
+            options.intra_op_num_threads = self.threads
+        session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        input_names = {node.name for node in session.get_inputs()}
+
+        def encode(inputs):
+            return session.run(None, {name: array for name, array in inputs.items() if name in input_names})[0]
+
+        return encode
+
+    def _embed(self, texts, instruction):
+        # Pooling skips [CLS] and the instruction's tokens, as INSTRUCTOR does
+        skip = len(self.tokenizer(instruction)["input_ids"]) - 1
+        skip = skip if skip > 1 else 0
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        vectors = [None] * len(texts)
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            inputs = self.tokenizer([instruction + texts[i].strip() for i in batch], padding=True, truncation=True,
+                                    max_length=MAX_SEQ_LENGTH, return_tensors="np")
+            inputs = {name: array.astype(np.int64) for name, array in inputs.items()}
+            tokens = self._encode(inputs)
+            mask = inputs["attention_mask"].astype(np.float32)
+            mask[:, :skip] = 0
+            pooled = (tokens * mask[:, :, None]).sum(axis=1) / np.maximum(mask.sum(axis=1, keepdims=True), 1e-9)
+            pooled /= np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+            for i, vector in zip(batch, pooled):
+                vectors[i] = vector.tolist()
+        return vectors
+
+    def embed_documents(self, texts):
+        return self._embed(texts, EMBED_INSTRUCTION)
+
+    def embed_query(self, text):
+        return self._embed([text], QUERY_INSTRUCTION)[0]
+
+
+def check_retrieval_parity(reference, candidate, texts, queries, k=4):
+    """How closely candidate embeddings reproduce reference retrieval over the same texts.
+
+    recall_at_k is the share of the reference's top-k texts per query that the candidate
+    also returns; mean_cosine compares the two engines' vectors for the same document.
+    """
+    k = min(k, len(texts))
+    started = time.perf_counter()
+    reference_docs = np.asarray(reference.embed_documents(texts), dtype=np.float32)
+    reference_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    candidate_docs = np.asarray(candidate.embed_documents(texts), dtype=np.float32)
+    candidate_seconds = time.perf_counter() - started
+
+    hits = 0
+    for query in queries:
+        expected = np.argsort(-(reference_docs @ np.asarray(reference.embed_query(query), dtype=np.float32)))[:k]
+        found = np.argsort(-(candidate_docs @ np.asarray(candidate.embed_query(query), dtype=np.float32)))[:k]
+        hits += len(set(expected.tolist()) & set(found.tolist()))
+
+    norms = np.linalg.norm(reference_docs, axis=1) * np.linalg.norm(candidate_docs, axis=1)
+    cosines = (reference_docs * candidate_docs).sum(axis=1) / np.maximum(norms, 1e-12)
+    recall = hits / float(len(queries) * k) if queries else 1.0
+    return {
+        "recall_at_k": recall,
+        "k": k,
+        "queries": len(queries),
+        "mean_cosine": float(cosines.mean()) if len(texts) else 1.0,
+        "speedup": reference_seconds / candidate_seconds if candidate_seconds > 0 else None,
+        "passed": recall >= EMBEDDING_PARITY_MIN_RECALL,
+    }
@@ -0,0 +1,66 @@
+import logging
+import os
+import re
+from typing import Any, Dict, Optional
+
+from langchain.chains import LLMChain
+from langchain.chains.conversational_retrieval.prompts import CONDENSE_QUESTION_PROMPT
+from langchain_core.callbacks import CallbackManagerForChainRun
+
+from instrumentation import Span
+
+logger = logging.getLogger(__name__)
+
+# How follow-up questions are rewritten into standalone ones before retrieval:
+# "llm" (the answering model, every follow-up), "heuristic" (the answering model, only when the
+# question refers back to the conversation), "local" (the in-process CPU model) or "off"
+CONDENSE_MODE = os.getenv("CONDENSE_MODE", "llm").lower()
+
+CONDENSE_MODES = ("llm", "heuristic", "local", "off")
+
+# Words and phrases that only make sense with the earlier turns in view
+_REFERENCE_PATTERN = re.compile(
+    r"\b(it|its|it's|they|them|their|theirs|this|that|these|those|he|him|his|she|her|hers|"
+    r"former|latter|above|previous|previously|earlier|same|aforementioned|"
+    r"mentioned|said|else|other|another|also|more|again)\b"
+    r"|^\s*(and|but|so|or|what about|how about|why|why not)\b",
+    re.IGNORECASE,
+)
+# Prefix app.py adds to every question; it must not count as a reference
+QUESTION_PREFIX = "Based on the document context, please answer:"
+
+
+def refers_to_history(question):
+    """True when a question has pronouns or references that need the chat history to resolve"""
+    if question.startswith(QUESTION_PREFIX):
+        question = question[len(QUESTION_PREFIX):]
+    return bool(_REFERENCE_PATTERN.search(question))
+
+
+class CondenseQuestionChain(LLMChain):
+    """Question generator for ConversationalRetrievalChain that can skip the LLM round trip.
+
+    The retrieval chain only calls it on follow-up turns. Depending on the strategy it returns
+    the question unchanged or asks its LLM for a standalone rewrite, and records a
+    "condense_question" span either way so strategies can be compared.
+    """
+
+    strategy: str = "llm"
+
+    def _call(self, inputs: Dict[str, Any],
+              run_manager: Optional[CallbackManagerForChainRun] = None) -> Dict[str, str]:
+        question = inputs["question"]
+        with Span("condense_question", strategy=self.strategy) as span:
+            if self.strategy == "off" or (self.strategy == "heuristic" and not refers_to_history(question)):
+                span.add(skipped=1)
+                return {self.output_key: question}
+            span.add(rewritten=1)
+            return super()._call(inputs, run_manager)
+
+
+def build_condense_chain(llm, strategy=CONDENSE_MODE):
+    """Condensing chain for a strategy in CONDENSE_MODES, run by llm when it rewrites"""
+    if strategy not in CONDENSE_MODES:
+        logger.warning("Unknown CONDENSE_MODE %r, rewriting every follow-up with the LLM", strategy)
+        strategy = "llm"
+    return CondenseQuestionChain(llm=llm, prompt=CONDENSE_QUESTION_PROMPT, strategy=strategy)
@@ -0,0 +1,119 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+
+class RequestCancelled(Exception):
+    """Raised inside a request leg once another leg has won the race"""
+
+
+class HedgedRequest:
+    """Shared state for the legs of one logical request.
+
+    The first leg to claim the request (by streaming a token or by finishing) wins;
+    every other leg is cancelled and raises RequestCancelled at its next check().
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cancelled = {}
+        self.winner = None
+
+    def register(self, leg_name):
+        with self._lock:
+            event = threading.Event()
+            if self.winner is not None:
+                event.set()
+            self._cancelled[leg_name] = event
+            return event
+
+    def claim(self, leg_name):
+        with self._lock:
+            if self.winner is None:
+                self.winner = leg_name
+                for name, event in self._cancelled.items():
+                    if name != leg_name:
+                        event.set()
+            return self.winner == leg_name
+
+    def cancel_event(self, leg_name):
+        return self._cancelled[leg_name]
+
+    def check(self, leg_name):
+        if self._cancelled[leg_name].is_set():
+            raise RequestCancelled(leg_name)
+
+
+def retry_with_backoff(fn, max_retries=3, base_delay=1.0, max_delay=10.0, cancel_event=None, on_retry=None):
+    """Call fn() up to max_retries times, sleeping with full-jitter exponential backoff in between"""
+    for attempt in range(max_retries):
+        try:
+            return fn()
+        except RequestCancelled:
+            raise
+        except Exception as e:
+            if attempt == max_retries - 1:
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+            if on_retry is not None:
+                on_retry(attempt + 1, max_retries, e, delay)
+            if cancel_event is None:
+                time.sleep(delay)
+            elif cancel_event.wait(delay):
+                # Another leg answered while this one was backing off
+                raise RequestCancelled()
+
+
+def run_hedged(legs, hedge_after=None, initializer=None):
+    """Run legs[0], and start legs[1] if no answer arrived within hedge_after seconds.
+
+    Each leg is a (name, fn) pair where fn(request, leg_name) returns the result and
+    may call request.claim()/request.check() while it works. Returns (leg_name, result)
+    for the first leg that succeeds; a primary failure starts the hedge immediately.
+    """
+    request = HedgedRequest()
+    for name, _ in legs:
+        request.register(name)
+
+    executor = ThreadPoolExecutor(max_workers=len(legs), initializer=initializer)
+    try:
+        futures = {}
+        primary_name, primary_fn = legs[0]
+        futures[executor.submit(primary_fn, request, primary_name)] = primary_name
+        pending_legs = list(legs[1:])
+        errors = {}
+
+        while futures:
+            # With no hedge delay configured the next backend is only used on failure,
+            # and once a leg is streaming its answer there is nothing left to hedge
+            timeout = hedge_after if pending_legs and request.winner is None else None
+            done, _ = wait(list(futures), timeout=timeout, return_when=FIRST_COMPLETED)
+            start_hedge = not done
+
+            for future in done:
+                name = futures.pop(future)
+                error = future.exception()
+                if error is None:
+                    if request.claim(name):
+                        return name, future.result()
+                elif not isinstance(error, RequestCancelled):
+                    errors[name] = error
+                    start_hedge = True
+
+            if start_hedge and pending_legs and request.winner is None:
+                # The current leg is slow or failed: send the request to the next backend too
+                name, fn = pending_legs.pop(0)
+                logger.info("Hedging request to %s", name)
+                futures[executor.submit(fn, request, name)] = name
+
+        # Every leg failed; surface the primary's error first
+        if not errors:
+            raise RuntimeError("No backend returned an answer")
+        raise errors.get(primary_name) or next(iter(errors.values()))
+    finally:
+        # Losing legs keep running in the background until they notice the cancellation
+        executor.shutdown(wait=False)
@@ -0,0 +1,205 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from instrumentation import METRICS, record_span
+from requestExecution import RequestCancelled
+
+logger = logging.getLogger(__name__)
+
+# Concurrent calls allowed per backend, as "backend=limit,..." (0 or a missing backend means unlimited)
+SCHEDULER_CONCURRENCY = os.getenv(
+    "SCHEDULER_CONCURRENCY", "hf_no_token=2,hf_with_token=4,local=8,openai=8,openai_embeddings=8")
+# Calls started per second per backend, same format; bursts of up to the concurrency limit are allowed
+SCHEDULER_RATE_LIMIT = os.getenv("SCHEDULER_RATE_LIMIT", "hf_no_token=0.5,hf_with_token=2,openai=5")
+
+# How often a queued call checks whether its request was cancelled
+_CANCEL_POLL_SECONDS = 0.1
+
+
+def parse_backend_limits(value):
+    """"hf_no_token=2,openai=8" -> {"hf_no_token": 2.0, "openai": 8.0}"""
+    limits = {}
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        name, _, limit = item.partition("=")
+        try:
+            limits[name.strip()] = float(limit)
+        except ValueError:
+            logger.warning("Ignoring scheduler limit %r: not a number", item)
+    return limits
+
+
+class TokenBucket:
+    """Rate limiter where each call reserves a token and is told how long to wait for it.
+
+    Reservations may drive the balance negative, so waiting callers are served in order
+    without polling; a caller that gives up returns its token with refund().
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = max(1.0, burst)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return max(0.0, -self._tokens / self.rate)
+
+    def refund(self):
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + 1)
+
+
+class _Backend:
+    def __init__(self, name, concurrency, rate):
+        self.name = name
+        self.slots = threading.BoundedSemaphore(int(concurrency)) if concurrency else None
+        self.bucket = TokenBucket(rate, concurrency or 1) if rate else None
+        self.waiting = 0
+        self.running = 0
+        self.coalesced = 0
+
+
+class RequestScheduler:
+    """Process-wide gate for LLM and embedding calls.
+
+    Each backend has a concurrency limit and a token-bucket rate limit, so bursts queue
+    instead of tripping the provider's rate limits. Calls with the same key that overlap
+    in time are coalesced: only the first runs and the others share its result.
+    """
+
+    def __init__(self, concurrency=None, rates=None):
+        self.concurrency = parse_backend_limits(SCHEDULER_CONCURRENCY) if concurrency is None else concurrency
+        self.rates = parse_backend_limits(SCHEDULER_RATE_LIMIT) if rates is None else rates
+        self._backends = {}
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def _backend(self, name):
+        with self._lock:
+            backend = self._backends.get(name)
+            if backend is None:
+                backend = _Backend(name, self.concurrency.get(name, 0), self.rates.get(name, 0))
+                self._backends[name] = backend
+            return backend
+
+    def _publish(self, backend):
+        METRICS.set_gauge("scheduler_queue_depth", backend.waiting,
+                          "Calls waiting for a concurrency slot or rate-limit token.", backend=backend.name)
+        METRICS.set_gauge("scheduler_in_flight", backend.running,
+                          "Calls currently running against each backend.", backend=backend.name)
+
+    def run(self, backend_name, fn, key=None, cancel_event=None):
+        """Call fn() once the backend has capacity, or share the result of an identical call in flight"""
+        if key is None:
+            return self._run_limited(backend_name, fn, cancel_event)
+
+        with self._lock:
+            future = self._in_flight.get((backend_name, key))
+            leader = future is None
+            if leader:
+                future = Future()
+                self._in_flight[(backend_name, key)] = future
+
+        if not leader:
+            backend = self._backend(backend_name)
+            with self._lock:
+                backend.coalesced += 1
+            started = time.perf_counter()
+            try:
+                result = self._wait_for(future, cancel_event)
+            except RequestCancelled:
+                if cancel_event is not None and cancel_event.is_set():
+                    raise
+                # The call we joined was cancelled by its own caller, not by ours: run it ourselves
+                return self.run(backend_name, fn, key, cancel_event)
+            record_span("scheduler_wait", time.perf_counter() - started, {"coalesced": 1}, backend=backend_name)
+            return result
+
+        try:
+            result = self._run_limited(backend_name, fn, cancel_event)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._in_flight.pop((backend_name, key), None)
+
+    @staticmethod
+    def _wait_for(future, cancel_event):
+        if cancel_event is None:
+            return future.result()
+        while True:
+            try:
+                return future.result(timeout=_CANCEL_POLL_SECONDS)
+            except FutureTimeoutError:
+                if cancel_event.is_set():
+                    raise RequestCancelled()
+
+    def _run_limited(self, backend_name, fn, cancel_event):
+        backend = self._backend(backend_name)
+        started = time.perf_counter()
+        with self._lock:
+            backend.waiting += 1
+        self._publish(backend)
+        try:
+            # Take a concurrency slot first, then wait out the rate limit while holding it
+            if backend.slots is not None:
+                while not backend.slots.acquire(timeout=_CANCEL_POLL_SECONDS):
+                    if cancel_event is not None and cancel_event.is_set():
+                        raise RequestCancelled()
+            if backend.bucket is not None:
+                delay = backend.bucket.reserve()
+                cancelled = cancel_event.wait(delay) if cancel_event is not None else time.sleep(delay)
+                if cancelled:
+                    backend.bucket.refund()
+                    if backend.slots is not None:
+                        backend.slots.release()
+                    raise RequestCancelled()
+        finally:
+            with self._lock:
+                backend.waiting -= 1
+            self._publish(backend)
+        record_span("scheduler_wait", time.perf_counter() - started, {"calls": 1}, backend=backend_name)
+
+        with self._lock:
+            backend.running += 1
+        self._publish(backend)
+        try:
+            return fn()
+        finally:
+            with self._lock:
+                backend.running -= 1
+            if backend.slots is not None:
+                backend.slots.release()
+            self._publish(backend)
+
+    def stats(self):
+        """Queue depth, running calls, coalesced calls and limits per backend"""
+        with self._lock:
+            return {
+                name: {
+                    "waiting": backend.waiting,
+                    "running": backend.running,
+                    "coalesced": backend.coalesced,
+                    "concurrency": self.concurrency.get(name, 0),
+                    "rate_per_second": self.rates.get(name, 0),
+                }
+                for name, backend in sorted(self._backends.items())
+            }
+
+
+SCHEDULER = RequestScheduler()
@@ -0,0 +1,36 @@
+from langchain_core.documents import Document
+
+from contextPacker import pack_context
+from textChunker import TokenCounter, _approximate_counts
+
+COUNTER = TokenCounter(_approximate_counts, "approximate")
+
+
+def test_short_sentence_inside_a_packed_word_is_kept():
+    chunks = [
+        Document(page_content="The warranty does not cover water damage."),
+        Document(page_content="Is water damage covered? No. Claims are refused."),
+    ]
+    packed, _, _ = pack_context("Is water damage covered?", chunks, COUNTER, 200)
+
+    assert "No." in packed[1].page_content
+
+
+def test_overlap_with_a_higher_ranked_chunk_is_dropped():
+    chunks = [
+        Document(page_content="Refunds take five days. Contact support for help."),
+        Document(page_content="Contact support for help. Shipping is free."),
+    ]
+    packed, _, _ = pack_context("How long do refunds take?", chunks, COUNTER, 200)
+
+    assert packed[1].page_content == "Shipping is free."
+
+
+def test_small_budget_keeps_a_trimmed_top_chunk():
+    chunks = [Document(page_content="Refunds are paid back to the original card within five working days.")]
+    packed, _, context_tokens = pack_context("When are refunds paid?", chunks, COUNTER, 5)
+
+    assert len(packed) == 1
+    assert packed[0].metadata["trimmed"]
+    assert packed[0].page_content.startswith("Refunds")
+    assert 0 < context_tokens <= 5
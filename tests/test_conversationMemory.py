@@ -0,0 +1,42 @@
+from langchain_core.language_models.fake import FakeListLLM
+from langchain_core.messages import get_buffer_string
+
+from conversationMemory import TokenBudgetMemory
+from textChunker import TokenCounter, _approximate_counts
+
+COUNTER = TokenCounter(_approximate_counts, "approximate")
+
+
+class FailingLLM(FakeListLLM):
+    def _call(self, *args, **kwargs):
+        raise RuntimeError("backend unavailable")
+
+
+def _memory(llm):
+    return TokenBudgetMemory(llm=llm, token_counter=COUNTER, backend="test-memory", max_retries=2,
+                             base_delay=0.0, max_delay=0.0, max_token_limit=30,
+                             memory_key="chat_history", return_messages=True)
+
+
+def _save_turns(memory, turns):
+    for i in range(turns):
+        memory.save_context({"question": f"Question number {i} about the report?"},
+                            {"answer": f"Answer number {i} from the report text."})
+
+
+def test_older_turns_are_summarized_within_the_budget():
+    memory = _memory(FakeListLLM(responses=["The user asked about the report."]))
+    _save_turns(memory, 4)
+
+    assert memory.moving_summary_buffer == "The user asked about the report."
+    assert 0 < COUNTER.count_uncached([get_buffer_string(memory.chat_memory.messages)])[0] <= 30
+
+
+def test_failed_summary_falls_back_to_trimming():
+    memory = _memory(FailingLLM(responses=[]))
+    _save_turns(memory, 4)
+
+    assert memory.moving_summary_buffer == ""
+    messages = memory.chat_memory.messages
+    assert messages and messages[-1].content == "Answer number 3 from the report text."
+    assert COUNTER.count_uncached([get_buffer_string(memory.chat_memory.messages)])[0] <= 30
@@ -0,0 +1,37 @@
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from embeddingBatcher import DedupBatchEmbeddings
+
+
+class CountingEmbeddings(Embeddings):
+    def __init__(self):
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return [[float(len(text)), 0.5, 0.25] for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def test_duplicates_and_remembered_texts_are_embedded_once():
+    model = CountingEmbeddings()
+    embeddings = DedupBatchEmbeddings(model, batch_size=2, memo_size=8)
+
+    first = embeddings.embed_documents(["a", "bb", "a", "ccc"])
+    second = embeddings.embed_documents(["bb", "dddd"])
+
+    assert model.embedded == ["a", "bb", "ccc", "dddd"]
+    assert first == [[1.0, 0.5, 0.25], [2.0, 0.5, 0.25], [1.0, 0.5, 0.25], [3.0, 0.5, 0.25]]
+    assert second == [[2.0, 0.5, 0.25], [4.0, 0.5, 0.25]]
+
+
+def test_memo_keeps_bounded_float32_vectors():
+    embeddings = DedupBatchEmbeddings(CountingEmbeddings(), batch_size=4, memo_size=3)
+
+    embeddings.embed_documents(["a", "bb", "ccc", "dddd", "eeeee"])
+
+    assert len(embeddings._memo) == 3
+    assert all(isinstance(vector, np.ndarray) and vector.dtype == np.float32 for vector in embeddings._memo.values())
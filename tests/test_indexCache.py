@@ -0,0 +1,46 @@
+import os
+
+import indexCache
+from indexCache import evict_lru, get_cache_key
+
+
+def test_cache_key_covers_bytes_chunking_and_model():
+    key = get_cache_key(b"%PDF-1.4 one", 250, 50, "all-MiniLM-L6-v2")
+
+    assert key == get_cache_key(b"%PDF-1.4 one", 250, 50, "all-MiniLM-L6-v2")
+    assert len({
+        key,
+        get_cache_key(b"%PDF-1.4 two", 250, 50, "all-MiniLM-L6-v2"),
+        get_cache_key(b"%PDF-1.4 one", 500, 50, "all-MiniLM-L6-v2"),
+        get_cache_key(b"%PDF-1.4 one", 250, 0, "all-MiniLM-L6-v2"),
+        get_cache_key(b"%PDF-1.4 one", 250, 50, "text-embedding-ada-002"),
+    }) == 5
+
+
+def _entry(name, size, mtime):
+    path = os.path.join(indexCache.INDEX_CACHE_DIR, name)
+    os.makedirs(path)
+    with open(os.path.join(path, "index.faiss"), "wb") as f:
+        f.write(b"\0" * size)
+    os.utime(path, (mtime, mtime))
+
+
+def test_evict_lru_drops_oldest_entries_until_under_the_cap(tmp_path, monkeypatch):
+    monkeypatch.setattr(indexCache, "INDEX_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(indexCache, "INDEX_CACHE_MAX_MB", 2.5 / 1024)
+    for age, name in enumerate(["newest", "kept", "middle", "oldest"]):
+        _entry(name, 1024, mtime=1_000_000 - age)
+    # Partially written entries are never evicted by size
+    _entry(".tmp-writing", 4096, mtime=0)
+
+    evict_lru(keep="kept")
+
+    assert sorted(os.listdir(tmp_path)) == [".tmp-writing", "kept", "newest"]
+
+
+def test_evict_lru_without_a_cache_dir_does_nothing(tmp_path, monkeypatch):
+    monkeypatch.setattr(indexCache, "INDEX_CACHE_DIR", str(tmp_path / "missing"))
+
+    evict_lru()
+
+    assert not os.path.exists(tmp_path / "missing")
@@ -0,0 +1,56 @@
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import FakeEmbeddings
+
+from indexRegistry import IndexRegistry, estimate_vectorstore_bytes
+from mappedStore import load_mapped_store, save_mapped_store
+from vectorIndex import build_index
+
+DIM = 32
+EMBEDDINGS = FakeEmbeddings(size=DIM)
+
+
+def _store(count, index_type="flat"):
+    vectors = np.random.default_rng(count).standard_normal((count, DIM)).astype(np.float32)
+    texts = [f"chunk {i}" for i in range(count)]
+    store = FAISS(embedding_function=EMBEDDINGS, index=build_index(vectors, index_type),
+                  docstore=InMemoryDocstore(), index_to_docstore_id={})
+    store.index.reset()
+    store.add_embeddings(list(zip(texts, vectors)), ids=[f"id-{i}" for i in range(count)])
+    return store
+
+
+def test_released_libraries_are_evicted_least_recently_used_first():
+    store = _store(10)
+    size = estimate_vectorstore_bytes(store)
+    registry = IndexRegistry(max_bytes=2 * size)
+
+    first = registry.register("first", store, {}, "model")
+    second = registry.register("second", _store(10), {}, "model")
+    third = registry.register("third", _store(10), {}, "model")
+    # Every library is in use, so none is dropped even over the budget
+    assert registry.stats()["indexes"] == 3
+
+    second.release()
+    first.release()
+    assert registry.acquire("second") is None
+    reacquired = registry.acquire("first")
+    assert reacquired.vectorstore is store
+    assert registry.stats() == {"indexes": 2, "in_use": 2, "bytes": 2 * size, "hits": 1, "misses": 1}
+    reacquired.release()
+    third.release()
+
+
+def test_mapped_ivfpq_store_counts_its_inverted_lists(tmp_path):
+    save_mapped_store(_store(1000, "ivfpq"), str(tmp_path / "library"))
+    mapped = load_mapped_store(str(tmp_path / "library"), EMBEDDINGS)
+    index = mapped.index
+
+    size = estimate_vectorstore_bytes(mapped)
+    assert size == index.ntotal * (index.invlists.code_size + 8)
+
+    registry = IndexRegistry(max_bytes=size)
+    registry.register("mapped", mapped, {}, "model").release()
+    registry.register("other", _store(10), {}, "model")
+    assert registry.acquire("mapped") is None
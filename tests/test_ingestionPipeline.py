@@ -0,0 +1,55 @@
+import hashlib
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+import ingestionPipeline
+from embeddingBatcher import DedupBatchEmbeddings
+
+
+class HashEmbeddings(Embeddings):
+    model_name = "hash-embeddings"
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        seed = int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:8], "little")
+        return np.random.default_rng(seed).standard_normal(8).astype(np.float32).tolist()
+
+
+def test_document_stores_come_back_in_upload_order_around_cached_ones(monkeypatch, make_pdf):
+    embeddings = DedupBatchEmbeddings(HashEmbeddings(), 16)
+    cached = {"cached-1.pdf": "cached store 1", "cached-3.pdf": "cached store 3"}
+    monkeypatch.setattr(ingestionPipeline, "_load_cached_document", lambda name, *args: cached.get(name))
+    monkeypatch.setattr(ingestionPipeline, "save_index", lambda cache_key, vectorstore: None)
+    monkeypatch.setattr("pageTextCache.PAGE_TEXT_CACHE_DIR", "")
+    names = ["new-0.pdf", "cached-1.pdf", "new-2.pdf", "cached-3.pdf", "new-4.pdf"]
+    files = [(name, make_pdf([f"Text of {name}"])) for name in names]
+
+    built = list(ingestionPipeline.iter_document_vectorstores(files, embeddings_loader=lambda model_name: embeddings))
+
+    assert [name for name, _ in built] == names
+    assert built[1][1] == "cached store 1" and built[3][1] == "cached store 3"
+    for name, vectorstore in (built[0], built[2], built[4]):
+        assert vectorstore.similarity_search(f"Text of {name}", k=1)[0].page_content == f"Text of {name}"
+
+
+class RecordingReporter(ingestionPipeline.ProgressReporter):
+    def __init__(self):
+        self.errors = []
+
+    def error(self, message):
+        self.errors.append(message)
+
+
+def test_pdf_with_only_blank_pages_reports_no_text_chunks(monkeypatch, make_pdf):
+    monkeypatch.setattr("pageTextCache.PAGE_TEXT_CACHE_DIR", "")
+    reporter = RecordingReporter()
+    pages = ingestionPipeline.iter_page_texts([("scan.pdf", make_pdf(["   ", ""]))], reporter)
+
+    chunks = list(ingestionPipeline.iter_text_chunks(pages, reporter, model_name=None))
+
+    assert chunks == []
+    assert reporter.errors == ["No readable text found in any of the uploaded PDF files.",
+                               "No text chunks created. The PDF might be empty or unreadable."]
@@ -0,0 +1,15 @@
+import importlib.metadata
+
+from pageTextCache import get_page_cache_key
+from pdfExtraction import get_extractor_fingerprint
+
+
+def test_cache_key_changes_with_the_extractor_and_its_version():
+    keys = {get_page_cache_key(b"%PDF-1.4 same bytes", extractors)
+            for extractors in ("pypdf2==3.0.1", "pypdf2==3.0.2", "pymupdf==1.24.0,pypdf2==3.0.1")}
+
+    assert len(keys) == 3
+
+
+def test_extractor_fingerprint_names_the_library_version():
+    assert get_extractor_fingerprint("pypdf2") == f"pypdf2=={importlib.metadata.version('PyPDF2')}"
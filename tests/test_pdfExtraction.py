@@ -0,0 +1,68 @@
+import os
+
+import pytest
+
+import pdfExtraction
+
+
+@pytest.fixture
+def pool(monkeypatch, tmp_path):
+    monkeypatch.setattr(pdfExtraction, "PDF_EXTRACT_WORKERS", 2)
+    monkeypatch.setattr(pdfExtraction, "PDF_PAGES_PER_TASK", 4)
+    monkeypatch.setattr(pdfExtraction, "PDF_MAX_PENDING_TASKS", 4)
+    monkeypatch.setattr("pageTextCache.PAGE_TEXT_CACHE_DIR", "")
+    monkeypatch.setattr("tempfile.tempdir", str(tmp_path))
+    yield tmp_path
+    pdfExtraction._reset_executor()
+
+
+def test_workers_hold_no_temp_file_once_a_file_is_extracted(pool, make_pdf):
+    pdf = make_pdf([f"Page number {i}" for i in range(20)])
+
+    result, = pdfExtraction.extract_pdf_pages([("long.pdf", pdf)])
+
+    assert [page.text.strip() for page in result.pages] == [f"Page number {i}" for i in range(20)]
+    assert not list(pool.iterdir())
+    for process in pdfExtraction._get_executor()._processes.values():
+        fd_dir = f"/proc/{process.pid}/fd"
+        if os.path.isdir(fd_dir):
+            targets = [os.readlink(os.path.join(fd_dir, fd)) for fd in os.listdir(fd_dir)]
+            assert not [target for target in targets if target.startswith(str(pool))]
+
+
+def test_worker_documents_of_finished_uploads_are_closed(tmp_path, monkeypatch, make_pdf):
+    closed = []
+    monkeypatch.setattr(pdfExtraction.PyPDF2Extractor, "close", lambda self, document: closed.append(document))
+    monkeypatch.setattr(pdfExtraction, "_worker_documents", {})
+    path = tmp_path / "upload.pdf"
+    path.write_bytes(make_pdf(["Only page"]))
+
+    first = pdfExtraction._worker_document_opener(str(path), "first", {"first"})("pypdf2")
+    pdfExtraction._worker_document_opener(str(path), "second", {"second"})("pypdf2")
+
+    assert closed == [first]
+    assert list(pdfExtraction._worker_documents) == ["second"]
+
+
+def test_small_files_are_extracted_ahead_in_the_pool(pool, monkeypatch, make_pdf):
+    submitted = []
+    submit_next = pdfExtraction._FileJob.submit_next
+
+    def record(job, executor):
+        submitted.append(job.name)
+        submit_next(job, executor)
+
+    monkeypatch.setattr(pdfExtraction._FileJob, "submit_next", record)
+    files = [(f"short-{i}.pdf", make_pdf([f"File {i} page {j}" for j in range(2)])) for i in range(6)]
+
+    results = pdfExtraction.iter_pdf_pages(files)
+    first = next(results)
+    first_page = next(first.pages)
+    # Taking the first file's only range tops the pool back up to four ranges from the files after it
+    assert submitted == [name for name, _ in files[:5]]
+    pages = [[first_page.text.strip()] + [page.text.strip() for page in first.pages]]
+    pages += [[page.text.strip() for page in result.pages] for result in results]
+
+    assert pages == [[f"File {i} page {j}" for j in range(2)] for i in range(6)]
+    assert not pdfExtraction._live_uploads
+    assert not list(pool.iterdir())
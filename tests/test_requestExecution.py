@@ -0,0 +1,32 @@
+import time
+
+from requestExecution import run_hedged
+
+
+def test_streaming_primary_suppresses_the_hedge():
+    started = []
+
+    def primary(request, leg_name):
+        # The first streamed token claims the request
+        request.claim(leg_name)
+        time.sleep(0.3)
+        return "primary answer"
+
+    def hedge(request, leg_name):
+        started.append(leg_name)
+        return "hedge answer"
+
+    assert run_hedged([("primary", primary), ("hedge", hedge)], hedge_after=0.05) == ("primary", "primary answer")
+    assert started == []
+
+
+def test_slow_primary_is_hedged():
+    def primary(request, leg_name):
+        time.sleep(0.3)
+        request.check(leg_name)
+        return "primary answer"
+
+    def hedge(request, leg_name):
+        return "hedge answer"
+
+    assert run_hedged([("primary", primary), ("hedge", hedge)], hedge_after=0.05) == ("hedge", "hedge answer")
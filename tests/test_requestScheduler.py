@@ -0,0 +1,70 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from requestScheduler import RequestScheduler
+
+
+def _wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def _run_overlapping(scheduler, fn, keys):
+    """Start one call per key; the first holds the backend until every other call is queued or joined"""
+    release = threading.Event()
+    calls = []
+
+    def blocking():
+        calls.append(1)
+        release.wait(5)
+        return fn()
+
+    with ThreadPoolExecutor(len(keys)) as pool:
+        futures = [pool.submit(scheduler.run, "llm", blocking, key=keys[0])]
+        _wait_until(lambda: calls)
+        futures += [pool.submit(scheduler.run, "llm", blocking, key=key) for key in keys[1:]]
+        _wait_until(lambda: len(calls) + scheduler.stats()["llm"]["coalesced"] == len(keys))
+        release.set()
+        return futures, calls
+
+
+def test_overlapping_calls_with_the_same_key_share_one_result():
+    scheduler = RequestScheduler(concurrency={}, rates={})
+
+    futures, calls = _run_overlapping(scheduler, lambda: object(), ["q", "q", "q"])
+
+    results = [future.result() for future in futures]
+    assert len(calls) == 1
+    assert results[0] is results[1] is results[2]
+    assert scheduler.stats()["llm"]["coalesced"] == 2
+
+
+def test_different_keys_and_later_calls_run_separately():
+    scheduler = RequestScheduler(concurrency={}, rates={})
+
+    futures, calls = _run_overlapping(scheduler, lambda: "answer", ["q", "other"])
+
+    assert [future.result() for future in futures] == ["answer", "answer"]
+    assert len(calls) == 2
+    # Only calls in flight are shared, finished results are not cached
+    assert scheduler.run("llm", lambda: "again", key="q") == "again"
+    assert scheduler.stats()["llm"]["coalesced"] == 0
+
+
+def test_a_failed_call_fails_every_caller_that_joined_it():
+    scheduler = RequestScheduler(concurrency={}, rates={})
+
+    def fail():
+        raise ValueError("backend down")
+
+    futures, calls = _run_overlapping(scheduler, fail, ["q", "q"])
+
+    for future in futures:
+        with pytest.raises(ValueError, match="backend down"):
+            future.result()
+    assert len(calls) == 1
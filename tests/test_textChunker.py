@@ -0,0 +1,48 @@
+from textChunker import PageText, TokenCounter, _approximate_counts, iter_token_chunks
+
+COUNTER = TokenCounter(_approximate_counts, "approximate")
+
+
+def test_whitespace_only_pages_give_no_empty_chunks():
+    pages = [PageText("a.pdf", 1, "Some text here."), PageText("a.pdf", 2, "  \n"),
+             PageText("scan.pdf", 1, " \n "), PageText("scan.pdf", 2, "\t")]
+
+    chunks = list(iter_token_chunks(pages, COUNTER, chunk_tokens=20, overlap_tokens=5))
+
+    assert [(chunk.page_content, chunk.metadata) for chunk in chunks] == [
+        ("Some text here.", {"source": "a.pdf", "page": 1})]
+
+
+def _words(count, start=0):
+    return " ".join(f"w{i}" for i in range(start, start + count))
+
+
+def test_chunks_stay_within_the_token_budget_and_overlap():
+    pages = [PageText("a.pdf", 1, _words(60)), PageText("a.pdf", 2, _words(60, start=60))]
+
+    chunks = list(iter_token_chunks(pages, COUNTER, chunk_tokens=20, overlap_tokens=5))
+    words = [chunk.page_content.split() for chunk in chunks]
+
+    assert all(len(chunk_words) <= 20 for chunk_words in words)
+    for previous, current in zip(words, words[1:]):
+        shared = int(previous[-1][1:]) - int(current[0][1:]) + 1
+        assert 0 < shared <= 5
+        assert previous[-shared:] == current[:shared]
+    # Every word appears, in order, once the overlaps are dropped
+    seen = [int(word[1:]) for chunk_words in words for word in chunk_words]
+    assert sorted(set(seen)) == list(range(120))
+    assert chunks[0].metadata == {"source": "a.pdf", "page": 1}
+    assert any(chunk.metadata == {"source": "a.pdf", "page": 1, "page_end": 2} for chunk in chunks)
+
+
+def test_chunks_never_span_two_files():
+    pages = [PageText("a.pdf", 1, _words(30)), PageText("b.pdf", 1, _words(3, start=100)),
+             PageText("c.pdf", 1, _words(30, start=200))]
+
+    chunks = list(iter_token_chunks(pages, COUNTER, chunk_tokens=20, overlap_tokens=5))
+
+    for chunk in chunks:
+        first = int(chunk.page_content.split()[0][1:]) // 100
+        assert {int(word[1:]) // 100 for word in chunk.page_content.split()} == {first}
+        assert chunk.metadata["source"] == "abc"[first] + ".pdf"
+    assert [chunk.page_content for chunk in chunks if chunk.metadata["source"] == "b.pdf"] == ["w100 w101 w102"]
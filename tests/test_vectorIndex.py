@@ -0,0 +1,48 @@
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import Embeddings
+
+from vectorIndex import build_index, delete_from_vectorstore, get_index_type
+
+DIM = 32
+
+
+class HashEmbeddings(Embeddings):
+    """A fixed random vector per text, so a chunk's own text finds it exactly"""
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        seed = int.from_bytes(text.encode("utf-8")[-8:].rjust(8, b"\0"), "big") % 2 ** 32
+        return np.random.default_rng(seed).standard_normal(DIM).astype(np.float32).tolist()
+
+
+def _ivfpq_store(texts):
+    embeddings = HashEmbeddings()
+    vectors = np.array(embeddings.embed_documents(texts), dtype=np.float32)
+    store = FAISS(embedding_function=embeddings, index=build_index(vectors, "ivfpq"),
+                  docstore=InMemoryDocstore(), index_to_docstore_id={})
+    store.index.reset()
+    store.add_texts(texts, ids=[f"chunk-{i}" for i in range(len(texts))])
+    store.index.nprobe = store.index.nlist
+    return store
+
+
+def test_search_after_deleting_from_ivfpq_returns_the_right_chunks():
+    texts = [f"chunk text {i}" for i in range(1000)]
+    store = _ivfpq_store(texts)
+    assert get_index_type(store.index) == "ivfpq"
+
+    delete_from_vectorstore(store, [f"chunk-{i}" for i in range(100, 200)])
+    assert store.index.ntotal == len(store.index_to_docstore_id) == 900
+
+    for i in (0, 99, 200, 999):
+        assert store.similarity_search(texts[i], k=1)[0].page_content == texts[i]
+    found = {doc.page_content for doc in store.similarity_search(texts[150], k=20)}
+    assert not found & set(texts[100:200])
+
+    store.add_texts(["chunk text added later"], ids=["chunk-new"])
+    assert store.similarity_search("chunk text added later", k=1)[0].page_content == "chunk text added later"
+    assert store.similarity_search(texts[999], k=1)[0].page_content == texts[999]
@@ -0,0 +1,185 @@
+import functools
+import itertools
+import logging
+import math
+import re
+import threading
+from collections import deque, namedtuple
+
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+# MiniLM embeds at most 256 tokens including [CLS] and [SEP]; anything longer is silently cut off
+CHUNK_TOKENS = 250
+CHUNK_OVERLAP_TOKENS = 50
+# Per-piece token counts remembered across pages (words repeat a lot)
+TOKEN_MEMO_SIZE = 200000
+
+PageText = namedtuple("PageText", ["source", "page", "text"])
+
+# Words with their leading whitespace, so joining pieces gives back the original text
+_PIECE_PATTERN = re.compile(r"\s*\S+|\s+$")
+_APPROX_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+_SENTENCE_END = (".", "!", "?", ":", ";")
+
+
+class TokenCounter:
+    """Counts tokens per text piece with a model's tokenizer, memoizing pieces already seen"""
+
+    def __init__(self, count_batch, name):
+        self._count_batch = count_batch
+        self.name = name
+        self._memo = {}
+        self._lock = threading.Lock()
+
+    def count(self, pieces):
+        with self._lock:
+            memo = self._memo
+            missing = list({piece for piece in pieces if piece not in memo})
+        counts = dict(zip(missing, self._count_batch(missing))) if missing else {}
+        with self._lock:
+            if len(self._memo) + len(counts) > TOKEN_MEMO_SIZE:
+                self._memo = {}
+            self._memo.update(counts)
+        # Look up in the memo seen at the start, in case another thread cleared it since
+        return [counts[piece] if piece in counts else memo[piece] for piece in pieces]
+
+    def count_uncached(self, texts):
+        """Counts without memoizing, for one-off texts such as whole prompts"""
+        return self._count_batch(list(texts))
+
+
+def _approximate_counts(pieces):
+    # Sub-word tokenizers never produce fewer tokens than words and punctuation marks
+    return [max(len(_APPROX_TOKEN_PATTERN.findall(piece)), math.ceil(len(piece.strip()) / 4)) for piece in pieces]
+
+
+@functools.lru_cache(maxsize=None)
+def get_token_counter(model_name):
+    """Token counter for a model: tiktoken for OpenAI, the HuggingFace tokenizer otherwise.
+
+    model_name None, or a tokenizer that cannot be loaded (e.g. offline), gives a conservative estimate.
+    """
+    if model_name is None:
+        return TokenCounter(_approximate_counts, "approximate")
+    try:
+        if model_name.startswith(("text-embedding-", "gpt-")):
+            import tiktoken
+
+            encoding = tiktoken.encoding_for_model(model_name)
+            return TokenCounter(lambda pieces: [len(tokens) for tokens in encoding.encode_batch(pieces)], model_name)
+
+        from transformers import AutoTokenizer
+
+        try:
+            # Usually already downloaded along with the embedding model
+            tokenizer = AutoTokenizer.from_pretrained(model_name, local_files_only=True)
+        except OSError:
+            tokenizer = AutoTokenizer.from_pretrained(model_name)
+        return TokenCounter(
+            lambda pieces: [len(ids) for ids in tokenizer(pieces, add_special_tokens=False)["input_ids"]],
+            model_name)
+    except Exception as e:
+        logger.warning("Could not load the %s tokenizer, estimating token counts: %s", model_name, e)
+        return TokenCounter(_approximate_counts, "approximate")
+
+
+def _starts_line(piece):
+    # Pieces carry their leading whitespace, so a line break shows up at the start of the next piece
+    return "\n" in piece[:len(piece) - len(piece.lstrip())]
+
+
+def _chunk_end(window, chunk_tokens, final):
+    """Pieces to put in the next chunk: as many as fit, ending on a line or sentence break if one is near"""
+    total = 0
+    end = 0
+    breaks = []
+    for piece, tokens, _ in window:
+        if end and _starts_line(piece):
+            breaks.append((end, total))
+        if total + tokens > chunk_tokens:
+            break
+        total += tokens
+        end += 1
+        if piece.endswith(_SENTENCE_END):
+            breaks.append((end, total))
+    if end == 0:
+        # A single piece longer than a chunk goes out alone
+        return 1
+    if final and end == len(window):
+        # The rest of the file fits in one chunk
+        return end
+    # Only break early if the chunk stays at least half full
+    if breaks and breaks[-1][1] >= chunk_tokens // 2:
+        return breaks[-1][0]
+    return end
+
+
+def _make_chunk(pieces):
+    first_page, last_page = pieces[0][2], pieces[-1][2]
+    metadata = {"source": first_page.source, "page": first_page.page}
+    if last_page.page != first_page.page:
+        metadata["page_end"] = last_page.page
+    text = "".join(piece for piece, _, _ in pieces).strip()
+    return Document(page_content=text, metadata=metadata)
+
+
+def iter_token_chunks(pages, token_counter, chunk_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    """Split a stream of PageTexts into Documents of at most chunk_tokens tokens.
+
+    Each page is tokenized once, as word pieces; a chunk is a run of consecutive pieces, so
+    the work is linear in the input and only one chunk's worth of text is held at a time.
+    Consecutive chunks share about overlap_tokens tokens and never mix two source files.
+    """
+    window = deque()
+    window_tokens = 0
+    # Leading pieces of the window that are overlap already sent in the previous chunk
+    emitted = 0
+    source = None
+
+    def flush(final):
+        nonlocal window_tokens, emitted
+        while window and (window_tokens > chunk_tokens or (final and len(window) > emitted)):
+            end = _chunk_end(window, chunk_tokens, final)
+            chunk_pieces = list(itertools.islice(window, end))
+            chunk = _make_chunk(chunk_pieces)
+            if chunk.page_content:
+                # Embedding APIs reject empty input
+                yield chunk
+
+            # Keep the chunk's last ~overlap_tokens tokens at the front of the window
+            keep = 0
+            keep_tokens = 0
+            for _, tokens, _ in reversed(chunk_pieces):
+                if keep_tokens + tokens > overlap_tokens or keep + 1 >= end:
+                    break
+                keep += 1
+                keep_tokens += tokens
+            for _ in range(end - keep):
+                window_tokens -= window.popleft()[1]
+            emitted = keep
+            if final and len(window) == emitted:
+                break
+
+    for page in pages:
+        if page.source != source:
+            # Chunks never span two files
+            yield from flush(final=True)
+            window.clear()
+            window_tokens = 0
+            emitted = 0
+            source = page.source
+
+        if not page.text.strip():
+            continue
+        pieces = _PIECE_PATTERN.findall(page.text)
+        if window and not window[-1][0][-1].isspace() and not pieces[0][0].isspace():
+            pieces[0] = "\n" + pieces[0]
+        for piece, tokens in zip(pieces, token_counter.count(pieces)):
+            window.append((piece, tokens, page))
+            window_tokens += tokens
+            if window_tokens > chunk_tokens:
+                yield from flush(final=False)
+
+    yield from flush(final=True)
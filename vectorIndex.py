@@ -0,0 +1,172 @@
+import logging
+import math
+import os
+import time
+
+import faiss
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# "auto" picks by corpus size; "flat", "hnsw" or "ivfpq" force one index type
+VECTOR_INDEX_TYPE = os.getenv("VECTOR_INDEX_TYPE", "auto").lower()
+HNSW_MIN_VECTORS = int(os.getenv("HNSW_MIN_VECTORS", "20000"))
+IVFPQ_MIN_VECTORS = int(os.getenv("IVFPQ_MIN_VECTORS", "200000"))
+
+HNSW_NEIGHBORS = 32
+HNSW_EF_SEARCH = 64
+IVF_NPROBE = 16
+PQ_MIN_TRAINING_VECTORS = 256
+# FAISS wants ~39 points per PQ centroid (256 of them) for stable training
+PQ_TRAINING_SAMPLE = 10000
+
+# Index types in the order a growing corpus moves through them
+INDEX_TYPES = ["flat", "hnsw", "ivfpq"]
+
+
+def get_index_type(index):
+    # Compact stores (see mappedStore) use the scalar-quantized variants of flat and HNSW
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivfpq"
+    return "flat"
+
+
+def choose_index_type(num_vectors):
+    """Index type for a corpus of num_vectors, honouring VECTOR_INDEX_TYPE when it is set"""
+    if VECTOR_INDEX_TYPE in INDEX_TYPES:
+        return VECTOR_INDEX_TYPE
+    if num_vectors >= IVFPQ_MIN_VECTORS:
+        return "ivfpq"
+    if num_vectors >= HNSW_MIN_VECTORS:
+        return "hnsw"
+    return "flat"
+
+
+def _pq_subquantizers(dim):
+    # PQ needs the dimension to split evenly; prefer more sub-quantizers for better recall
+    for m in (64, 48, 32, 24, 16, 8, 4, 2, 1):
+        if dim % m == 0:
+            return m
+    return 1
+
+
+def build_index(vectors, index_type):
+    """Build (and train, for IVF-PQ) a FAISS index of the given type holding vectors"""
+    num_vectors, dim = vectors.shape
+
+    if index_type == "ivfpq":
+        nlist = min(max(16, int(4 * math.sqrt(num_vectors))), max(1, num_vectors // 39))
+        if num_vectors < PQ_MIN_TRAINING_VECTORS:
+            logger.warning("Too few vectors (%d) to train IVF-PQ, using HNSW", num_vectors)
+            index_type = "hnsw"
+        else:
+            index = faiss.IndexIVFPQ(faiss.IndexFlatL2(dim), dim, nlist, _pq_subquantizers(dim), 8)
+            sample_size = min(num_vectors, max(nlist * 64, PQ_TRAINING_SAMPLE))
+            sample = vectors[np.random.default_rng(0).choice(num_vectors, sample_size, replace=False)]
+            index.train(sample)
+            index.nprobe = min(nlist, IVF_NPROBE)
+            index.add(vectors)
+            return index
+
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, HNSW_NEIGHBORS)
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+        index.add(vectors)
+        return index
+
+    index = faiss.IndexFlatL2(dim)
+    index.add(vectors)
+    return index
+
+
+def reconstruct_vectors(index):
+    """Exact stored vectors of a flat or HNSW index (IVF-PQ only keeps compressed codes)"""
+    if index.ntotal == 0:
+        return np.zeros((0, index.d), dtype=np.float32)
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def evaluate_index(index, vectors, k=4, num_queries=100):
+    """Recall@k and per-query latency of index against an exact flat baseline over the same vectors"""
+    num_vectors = vectors.shape[0]
+    rng = np.random.default_rng(0)
+    queries = vectors[rng.choice(num_vectors, min(num_queries, num_vectors), replace=False)]
+    k = min(k, num_vectors)
+
+    baseline = faiss.IndexFlatL2(vectors.shape[1])
+    baseline.add(vectors)
+    started = time.perf_counter()
+    _, expected = baseline.search(queries, k)
+    flat_ms = (time.perf_counter() - started) * 1000 / len(queries)
+
+    started = time.perf_counter()
+    _, found = index.search(queries, k)
+    index_ms = (time.perf_counter() - started) * 1000 / len(queries)
+
+    hits = sum(len(set(row_found) & set(row_expected)) for row_found, row_expected in zip(found, expected))
+    return {
+        "index_type": get_index_type(index),
+        "vectors": num_vectors,
+        "recall_at_k": hits / float(len(queries) * k),
+        "k": k,
+        "query_ms": index_ms,
+        "flat_query_ms": flat_ms,
+    }
+
+
+def optimize_vectorstore(vectorstore):
+    """Move a LangChain FAISS store to the index type its size calls for, training it if needed.
+
+    Returns an evaluation report against the flat baseline when the index changed, else None.
+    The docstore and id mapping are untouched because vectors keep their positions.
+    """
+    current = get_index_type(vectorstore.index)
+    target = choose_index_type(vectorstore.index.ntotal)
+    # Never go back from IVF-PQ: its compressed codes cannot be turned back into exact vectors
+    if target == current or current == "ivfpq":
+        return None
+
+    vectors = reconstruct_vectors(vectorstore.index)
+    index = build_index(vectors, target)
+    report = evaluate_index(index, vectors)
+    vectorstore.index = index
+    logger.info("Switched vector index from %s to %s: %s", current, report["index_type"], report)
+    return report
+
+
+def _renumber_ivf_ids(index, old_to_new):
+    # IVF lists store each vector's id rather than its position, so removals leave gaps
+    invlists = index.invlists
+    for list_no in range(index.nlist):
+        size = invlists.list_size(list_no)
+        if size:
+            ids = faiss.rev_swig_ptr(invlists.get_ids(list_no), size)
+            ids[:] = old_to_new[ids]
+
+
+def delete_from_vectorstore(vectorstore, ids):
+    """Delete chunks by docstore id, keeping index positions in step with the docstore id mapping.
+
+    HNSW indexes cannot remove vectors, so they are rebuilt from the rest. IVF-PQ indexes remove
+    them but keep the old ids of the others, which are then renumbered to match LangChain's mapping.
+    """
+    index = vectorstore.index
+    if not isinstance(index, (faiss.IndexHNSW, faiss.IndexIVF)):
+        vectorstore.delete(ids)
+        return
+
+    ids = set(ids)
+    mapping = vectorstore.index_to_docstore_id
+    keep = [i for i, doc_id in sorted(mapping.items()) if doc_id not in ids]
+    if isinstance(index, faiss.IndexHNSW):
+        vectorstore.index = build_index(reconstruct_vectors(index)[keep], "hnsw")
+    else:
+        removed = [i for i, doc_id in mapping.items() if doc_id in ids]
+        index.remove_ids(np.array(removed, dtype=np.int64))
+        old_to_new = np.full(len(mapping), -1, dtype=np.int64)
+        old_to_new[keep] = np.arange(len(keep))
+        _renumber_ivf_ids(index, old_to_new)
+    vectorstore.index_to_docstore_id = {new_i: mapping[old_i] for new_i, old_i in enumerate(keep)}
+    vectorstore.docstore.delete(list(ids))
@@ -0,0 +1,62 @@
+import logging
+import os
+import threading
+import time
+
+from instrumentation import Span
+
+logger = logging.getLogger(__name__)
+
+# Load models in the background as soon as the server handles its first script run
+WARMUP_ON_START = os.getenv("WARMUP_ON_START", "true").lower() == "true"
+
+
+class Warmup:
+    """Runs named loading steps once, in order, on a background thread and times each of them.
+
+    Steps that fail are logged and skipped; whatever they load is simply loaded again on first use.
+    """
+
+    def __init__(self, steps):
+        self.steps = steps
+        self.timings = {}
+        self.errors = {}
+        self.first_render_seconds = None
+        self.total_seconds = None
+        self.ready = threading.Event()
+        self._started = None
+
+    def start(self):
+        self._started = time.perf_counter()
+        threading.Thread(target=self._run, name="warmup", daemon=True).start()
+        return self
+
+    def _run(self):
+        for name, load in self.steps:
+            started = time.perf_counter()
+            try:
+                with Span("warmup", step=name):
+                    load()
+            except Exception as e:
+                self.errors[name] = str(e)
+                logger.warning("Warm-up step %s failed: %s", name, e)
+            self.timings[name] = time.perf_counter() - started
+        self.total_seconds = time.perf_counter() - self._started
+        self.ready.set()
+        logger.info("Warm-up finished in %.1f s: %s", self.total_seconds,
+                    ", ".join(f"{name} {seconds:.1f} s" for name, seconds in self.timings.items()))
+
+    def record_first_render(self, seconds):
+        """Time the first script run took to render, before any model was needed"""
+        if self.first_render_seconds is None:
+            self.first_render_seconds = seconds
+            logger.info("First page rendered in %.2f s", seconds)
+
+    def status(self):
+        return {
+            "ready": self.ready.is_set(),
+            "first_render_seconds": self.first_render_seconds,
+            "total_seconds": self.total_seconds,
+            "timings": dict(self.timings),
+            "errors": dict(self.errors),
+        }